@@ -8,9 +8,30 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
-from io import StringIO
+from io import StringIO, BytesIO, TextIOWrapper
+import cProfile
+import hashlib
+import hmac
+import inspect
+import json
+import os
+import pstats
+import re
+import stat
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 # import reff
-from wordcloud import WordCloud
+from wordcloud import WordCloud, STOPWORDS
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -178,6 +199,12 @@ def detect_name_column(df):
             return col
     return None
 
+def detect_test_columns(df):
+    """Dynamically detect Pre-Test and Post-Test score columns"""
+    pre_test_cols = [col for col in df.columns if 'pre' in col.lower() and 'score' in col.lower()]
+    post_test_cols = [col for col in df.columns if 'post' in col.lower() and 'score' in col.lower()]
+    return pre_test_cols, post_test_cols
+
 def extract_email_prefix(email):
     """Extract prefix from email (before @)"""
     if pd.isna(email) or not isinstance(email, str):
@@ -215,6 +242,2267 @@ def get_insight_class(category):
     else:
         return "insight-needs-improvement"
 
+def hash_columns(df):
+    """64-bit value hashes of every column, the basis of dataset, column and row versions"""
+    return [pd.util.hash_pandas_object(df.iloc[:, i], index=False).to_numpy() for i in range(df.shape[1])]
+
+def compute_row_hashes(df, column_hashes=None):
+    """Order-sensitive combination of each row's column hashes"""
+    column_hashes = hash_columns(df) if column_hashes is None else column_hashes
+    row_hashes = np.full(len(df), 0x9E3779B97F4A7C15, dtype=np.uint64)
+    for i, hashes in enumerate(column_hashes):
+        row_hashes = (row_hashes ^ hashes) * np.uint64(1000003 + 2 * i)
+    return row_hashes
+
+def compute_dataset_version(df, row_hashes=None):
+    """Content hash identifying a published dataset version"""
+    row_hashes = compute_row_hashes(df) if row_hashes is None else row_hashes
+    digest = hashlib.sha1(row_hashes.tobytes())
+    digest.update('|'.join(map(str, df.columns)).encode())
+    return digest.hexdigest()[:16]
+
+def compute_column_versions(df, column_hashes):
+    """Content version of each column; columns an upload did not touch keep theirs"""
+    versions = {}
+    for col, dtype, hashes in zip(df.columns, df.dtypes, column_hashes):
+        digest = hashlib.sha1(hashes.tobytes())
+        digest.update(f"{col}|{dtype}".encode())
+        versions[col] = digest.hexdigest()[:16]
+    return versions
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_column_versions(_df, version):
+    """Column versions of a dataset version, stamped at upload or computed once here"""
+    store = get_dataset_store()
+    if store['version'] == version and store['column_versions'] is not None:
+        return store['column_versions']
+    return compute_column_versions(_df, hash_columns(_df))
+
+def columns_version(versions, columns):
+    """Cache key covering the content of several columns (None entries allowed)"""
+    return hashlib.sha1('|'.join(versions.get(col, '-') if col else '-' for col in columns).encode()).hexdigest()[:16]
+
+def profile_schema(df):
+    """Type, missing and unique counts per column"""
+    return pd.DataFrame({
+        'Column': df.columns,
+        'Type': [str(dtype) for dtype in df.dtypes],
+        'Missing': df.isnull().sum().to_numpy(),
+        'Unique': df.nunique().to_numpy()
+    })
+
+def tracked_resource(max_entries, category='Derived arrays', cost=1.0, patch=None):
+    """st.cache_resource whose entries the memory manager accounts, touches on every hit and can release
+
+    Underscore arguments are left out of the entry key and released as None, like Streamlit's
+    own hashing; entries Streamlit drops past ``max_entries`` stop being accounted.
+
+    With ``patch``, a miss on the published dataset that was published as an in-place row edit
+    of the previous one (see ``row_delta``) first tries ``patch(previous, rows, columns, *args)``
+    on the entry built for the previous dataset with the same arguments after the first hashed
+    one; it returns None to fall back to a full build.
+    """
+    def decorate(fn):
+        hashed = [not name.startswith('_') for name in inspect.signature(fn).parameters]
+        keys = {}
+        latest = {}
+
+        def forget_latest(value):
+            for slot in [slot for slot, (_, kept) in latest.items() if kept is value]:
+                latest.pop(slot, None)
+
+        def dropped(value):
+            forget_latest(value)
+            for key in keys.pop(id(value), ()):
+                get_memory_manager().forget(key)
+
+        def build(*args):
+            _, delta = published_delta(args[0])
+            previous = latest.get(tuple(arg for arg, keep in zip(args, hashed) if keep)[1:])
+            if delta is not None and previous is not None and previous[0] == delta['base']:
+                value = patch(previous[1], delta['rows'], delta['columns'], *args)
+                if value is not None:
+                    return value
+            return fn(*args)
+
+        cached = st.cache_resource(show_spinner=False, max_entries=max_entries,
+                                   on_release=dropped)(wraps(fn)(build) if patch else fn)
+
+        def release(value, clear):
+            clear()
+            forget_latest(value)
+
+        @wraps(fn)
+        def wrapper(*args):
+            value = cached(*args)
+            key = (fn.__name__, *(arg for arg, keep in zip(args, hashed) if keep))
+            keys.setdefault(id(value), set()).add(key)
+            clear = partial(cached.clear, *(arg if keep else None for arg, keep in zip(args, hashed)))
+            if patch:
+                latest[key[2:]] = (published_delta(args[0])[0], value)
+            get_memory_manager().track(key, category, value, release=partial(release, value, clear), cost=cost)
+            return value
+
+        wrapper.clear = cached.clear
+        return wrapper
+    return decorate
+
+def published_delta(df):
+    """Version of a frame if it is the published dataset, and the row delta it was published with"""
+    store = get_dataset_store()
+    if store['data'] is not df:
+        return None, None
+    return store['version'], store['delta']
+
+def get_dataset_version():
+    """Version of the active dataset, computed lazily if not stamped at upload"""
+    if st.session_state.dataset_version is None and st.session_state.uploaded_data is not None:
+        st.session_state.dataset_version = compute_dataset_version(st.session_state.uploaded_data)
+    return st.session_state.dataset_version
+
+CHART_MAX_WIDTH = 1400
+
+@tracked_resource(max_entries=64, category='Rendered charts')
+def render_chart(_draw, key):
+    """PNG of the figure _draw() builds, rendered once per key (everything the chart depicts)"""
+    fig = _draw()
+    buffer = BytesIO()
+    # Streamlit re-encodes images wider than its content width on every send; stay under it
+    fig.savefig(buffer, format='png', bbox_inches='tight', dpi=min(200, CHART_MAX_WIDTH / fig.get_figwidth()))
+    plt.close(fig)
+    return buffer.getvalue()
+
+def show_chart(key, draw):
+    """Show a matplotlib chart, drawing it only when its key has not been rendered yet"""
+    st.image(render_chart(draw, key), use_container_width=True)
+
+# ==================== SCORING ENGINE ====================
+
+SCORED_COLUMNS = {'pre': 'PreTestScore', 'post': 'PostTestScore'}
+
+def normalize_numbers(series, parse=False):
+    """Answers as text, with numbers written canonically so 1, 1.0 and "1" all match"""
+    text = series.astype(str)
+    if not (parse or pd.api.types.is_numeric_dtype(series)):
+        return text
+    numbers = pd.to_numeric(series, errors='coerce')
+    integral = numbers.notna() & (numbers == np.floor(numbers)) & (numbers.abs() < 1e15)
+    fractional = numbers.notna() & ~integral
+    text[integral] = numbers[integral].astype(np.int64).astype(str)
+    text[fractional] = numbers[fractional].astype(str)
+    return text
+
+def normalize_responses(responses, parse_numbers=False):
+    """Normalize answers to a 2-D array for case/whitespace/number-format-insensitive matching
+
+    Numeric columns (a question column with blanks reads as float64) are always written
+    canonically; ``parse_numbers`` also parses text cells, which is only cheap for the key row.
+    """
+    columns = [normalize_numbers(responses.iloc[:, i], parse_numbers) for i in range(responses.shape[1])]
+    flat = pd.Series(np.column_stack([col.to_numpy(dtype=object) for col in columns]).ravel()
+                     if columns else np.array([], dtype=object))
+    normalized = flat.str.strip().str.casefold()
+    normalized[pd.isna(responses.to_numpy(dtype=object).ravel())] = ''
+    return normalized.to_numpy(dtype=object).reshape(responses.shape)
+
+def score_responses(responses, answers):
+    """Score every student against every question in one matrix comparison
+
+    Students who left every question blank did not sit the test and score NaN, not 0.
+    """
+    key = normalize_responses(pd.DataFrame([answers], columns=responses.columns), parse_numbers=True)[0]
+    normalized = normalize_responses(responses)
+    correct = (normalized == key[np.newaxis, :]) & (key != '')
+    answered = (normalized != '').any(axis=1)
+    scores = pd.Series(np.where(answered, correct.mean(axis=1) * 100, np.nan), index=responses.index)
+    return scores, correct
+
+def compute_item_statistics(correct, questions):
+    """Per-question difficulty and corrected point-biserial discrimination"""
+    items = correct.astype(float)
+    rest = items.sum(axis=1, keepdims=True) - items
+    items_c = items - items.mean(axis=0)
+    rest_c = rest - rest.mean(axis=0)
+    denom = np.sqrt((items_c ** 2).sum(axis=0) * (rest_c ** 2).sum(axis=0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        discrimination = np.where(denom > 0, (items_c * rest_c).sum(axis=0) / denom, np.nan)
+    return pd.DataFrame({
+        'Question': questions,
+        'Difficulty': items.mean(axis=0),
+        'Discrimination': discrimination,
+        'Correct': correct.sum(axis=0)
+    })
+
+def apply_answer_keys(df, answer_keys):
+    """Add Pre/Post score columns from answer keys and return item statistics"""
+    df = df.copy()
+    item_statistics = {}
+    for test, key in answer_keys.items():
+        questions = [q for q, answer in key.items() if q in df.columns and str(answer).strip()]
+        if not questions:
+            continue
+        scores, correct = score_responses(df[questions], [key[q] for q in questions])
+        df[SCORED_COLUMNS[test]] = scores
+        item_statistics[test] = compute_item_statistics(correct[scores.notna().to_numpy()], questions)
+    return df, item_statistics
+
+def show_item_statistics(item_statistics):
+    """Render per-question difficulty and discrimination tables"""
+    for test, stats in item_statistics.items():
+        st.markdown(f"#### {'Pre-Test' if test == 'pre' else 'Post-Test'} Questions")
+        st.dataframe(
+            stats.style.format({'Difficulty': '{:.0%}', 'Discrimination': '{:.2f}'}),
+            use_container_width=True
+        )
+    st.markdown("""
+    <div class="info-box">
+    <strong>📌 Reading Item Statistics:</strong> Difficulty is the share of students answering correctly.
+    Discrimination is the correlation between a question and the rest of the test; values below 0.2
+    suggest the question does not separate strong and weak students.
+    </div>
+    """, unsafe_allow_html=True)
+
+@st.fragment
+def show_answer_key_editor(df):
+    """Let the admin pick question columns and enter answer keys"""
+    with st.expander("🧮 Answer-Key Scoring", expanded=bool(st.session_state.answer_keys)):
+        st.markdown('<div class="info-box">For raw per-question exports, select the question columns of each test and enter the correct answers. Pre/Post scores are computed automatically.</div>', unsafe_allow_html=True)
+        saved = st.session_state.answer_keys
+        candidates = [col for col in df.columns if col not in SCORED_COLUMNS.values()]
+        col1, col2 = st.columns(2)
+        with col1:
+            pre_questions = st.multiselect("Pre-Test question columns", candidates,
+                                           default=[q for q in saved.get('pre', {}) if q in candidates])
+        with col2:
+            post_questions = st.multiselect("Post-Test question columns", candidates,
+                                            default=[q for q in saved.get('post', {}) if q in candidates])
+        rows = [{'Test': test, 'Question': q, 'Answer': saved.get(test, {}).get(q, '')}
+                for test, questions in (('pre', pre_questions), ('post', post_questions))
+                for q in questions]
+        if not rows:
+            return
+        edited = st.data_editor(pd.DataFrame(rows), disabled=['Test', 'Question'],
+                                hide_index=True, use_container_width=True, key="answer_key_editor")
+        if st.button("✅ Apply Answer Keys"):
+            answer_keys = {}
+            for row in edited.itertuples(index=False):
+                answer_keys.setdefault(row.Test, {})[row.Question] = '' if pd.isna(row.Answer) else str(row.Answer)
+            st.session_state.answer_keys = answer_keys
+            st.rerun()
+
+# ==================== TEXT ANALYTICS ====================
+
+TOKEN_PATTERN = r"[a-z][a-z0-9+#']+"
+TOKEN_CHUNK_SIZE = 50000
+TEXT_STOPWORDS = frozenset(STOPWORDS | {'chatgpt', 'gpt', 'also', 'really', 'lot', 'things', 'thing'})
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def is_text_column(_df, column_version, column):
+    """Whether a column holds open-ended answers (3+ words on average), decided once per column content"""
+    values = _df[column].dropna().astype(str)
+    return bool(not values.empty and values.str.split().str.len().mean() >= 3)
+
+def detect_text_columns(df, version):
+    """Dynamically detect open-ended free-text response columns"""
+    skip = {detect_email_column(df), detect_name_column(df)}
+    versions = get_column_versions(df, version)
+    return [col for col in df.columns
+            if col not in skip and not pd.api.types.is_numeric_dtype(df[col])
+            and is_text_column(df, versions[col], col)]
+
+def tokenize_responses(series, start=0):
+    """Tokenize responses chunk by chunk into a (row, term) frame"""
+    parts = []
+    for begin in range(0, len(series), TOKEN_CHUNK_SIZE):
+        values = series.iloc[begin:begin + TOKEN_CHUNK_SIZE].to_numpy()
+        chunk = pd.Series(values, index=np.arange(len(values)) + start + begin)
+        terms = chunk.fillna('').astype(str).str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+        terms = terms[~terms.isin(TEXT_STOPWORDS)]
+        parts.append(pd.DataFrame({'row': terms.index.to_numpy(dtype=np.int64), 'term': terms.to_numpy()}))
+    if not parts:
+        return pd.DataFrame({'row': np.array([], dtype=np.int64), 'term': np.array([], dtype=object)})
+    return pd.concat(parts, ignore_index=True)
+
+@st.cache_resource
+def get_token_store():
+    """Process-wide store of tokenized text columns, shared by all sessions"""
+    return {}
+
+def get_column_tokens(df, column, version):
+    """Cached tokens for a text column; only responses not seen in the cached version are tokenized"""
+    store = get_token_store()
+    entry = store.get(column)
+    column_version = get_column_versions(df, version)[column]
+    if entry is not None and entry['version'] == column_version:
+        get_memory_manager().touch(('tokens', column))
+        return entry['tokens']
+
+    row_hashes = pd.util.hash_pandas_object(df[column], index=False).to_numpy()
+    source = np.full(len(row_hashes), -1)
+    if entry is not None:
+        # Reuse tokens of any cached row with identical text, wherever it moved to
+        cached = pd.Index(entry['row_hashes'])
+        first = np.flatnonzero(~cached.duplicated())
+        hit = cached[first].get_indexer(row_hashes)
+        source = np.where(hit >= 0, first[hit], -1)
+    reused = np.flatnonzero(source >= 0)
+    fresh = np.flatnonzero(source < 0)
+    parts = [tokenize_responses(df[column].iloc[fresh]).assign(row=lambda t: fresh[t['row'].to_numpy()])]
+    if reused.size:
+        moved = pd.DataFrame({'row': reused, 'source': source[reused]})
+        parts.append(moved.merge(entry['tokens'].rename(columns={'row': 'source'}), on='source')[['row', 'term']])
+    tokens = pd.concat(parts, ignore_index=True)
+    store[column] = {'version': column_version, 'row_hashes': row_hashes, 'tokens': tokens}
+    get_memory_manager().track(('tokens', column), 'Derived arrays', store[column],
+                               release=partial(store.pop, column, None), cost=5.0)
+    return tokens
+
+def distinctive_terms(tokens, groups, first, second, prior=0.5):
+    """Smoothed log-odds ratio of each term between two student groups"""
+    labelled = tokens.assign(group=groups[tokens['row'].to_numpy()])
+    counts = (labelled.groupby(['term', 'group']).size().unstack(fill_value=0)
+              .reindex(columns=[first, second], fill_value=0))
+    counts = counts[counts.sum(axis=1) > 1]
+    if counts.empty:
+        return pd.Series(dtype=float)
+    rates = np.log((counts + prior) / (counts.sum() + prior * len(counts)))
+    return (rates[first] - rates[second]).sort_values(ascending=False)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def render_word_cloud(frequencies, colormap):
+    """Word cloud PNG for term frequencies, laid out and encoded once per distinct input"""
+    cloud = WordCloud(width=800, height=400, background_color='white', colormap=colormap)
+    cloud.generate_from_frequencies({str(term): float(freq) for term, freq in frequencies.items()})
+    buffer = BytesIO()
+    cloud.to_image().save(buffer, format='PNG')
+    return buffer.getvalue()
+
+@tracked_resource(max_entries=16)
+def get_term_statistics(_base_df, _df, column, version, rows_key):
+    """Term frequencies and improved-vs-declined log-odds for a set of rows, cached per column"""
+    tokens = get_column_tokens(_base_df, column, version)
+    if len(_df) < len(_base_df):
+        tokens = tokens[np.isin(tokens['row'].to_numpy(), _df.index.to_numpy())]
+    statistics = {'frequencies': tokens['term'].value_counts().head(200), 'log_odds': None}
+    if 'Improvement' in _df.columns and not tokens.empty:
+        improvement = _df['Improvement'].to_numpy()
+        groups = np.full(len(_base_df), 'Other', dtype=object)
+        groups[_df.index.to_numpy()] = np.where(improvement > 0, 'Improved',
+                                                np.where(improvement < 0, 'Declined', 'Other'))
+        statistics['log_odds'] = distinctive_terms(tokens, groups, 'Improved', 'Declined')
+    return statistics
+
+def plot_word_cloud(frequencies, title, colormap='viridis'):
+    """Render a word cloud from term frequencies"""
+    if len(frequencies) == 0:
+        st.info("Not enough text to build a word cloud.")
+        return
+    st.markdown(f"**{title}**")
+    st.image(render_word_cloud(frequencies, colormap), use_container_width=True)
+
+@st.fragment
+def show_text_analytics(df, version):
+    """Term frequencies, distinctive terms and word clouds for free-text columns
+
+    ``df`` may be a cohort slice of the active dataset; tokens are cached for the
+    full dataset and restricted to the slice's rows by position. Runs as a fragment,
+    so picking another column reruns only this section.
+    """
+    base_df = st.session_state.uploaded_data
+    text_cols = detect_text_columns(base_df, version)
+    if not text_cols:
+        return
+
+    st.markdown("---")
+    st.markdown("## 💬 Free-Text Feedback Analysis")
+    column = st.selectbox("Response column", text_cols, key="text_analytics_column")
+    rows_key = f"{hashlib.sha1(df.index.to_numpy().tobytes()).hexdigest()[:16]}-{'Improvement' in df.columns}"
+    statistics = get_term_statistics(base_df, df, column, version, rows_key)
+    frequencies = statistics['frequencies']
+    if frequencies.empty:
+        st.info("No usable words found in this column.")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("### 🔤 Most Frequent Terms")
+        def draw_top_terms():
+            fig, ax = plt.subplots(figsize=(10, 6))
+            top_terms = frequencies.head(15)[::-1]
+            ax.barh(top_terms.index, top_terms.values, color='#667eea', alpha=0.8)
+            ax.set_xlabel('Mentions', fontsize=12, fontweight='bold')
+            ax.set_title('Top Terms', fontsize=14, fontweight='bold', pad=20)
+            ax.grid(axis='x', alpha=0.3)
+            return fig
+
+        show_chart((version, column, rows_key, 'top_terms'), draw_top_terms)
+    with col2:
+        st.markdown("### ☁️ Word Cloud")
+        plot_word_cloud(frequencies, 'All Responses')
+
+    log_odds = statistics['log_odds']
+    if log_odds is None:
+        return
+
+    st.markdown("### 🔍 Distinctive Terms: Improved vs Declined")
+    col1, col2 = st.columns(2)
+    with col1:
+        plot_word_cloud(np.exp(log_odds[log_odds > 0].head(100)), 'Improved Students', 'Greens')
+    with col2:
+        plot_word_cloud(np.exp(-log_odds[log_odds < 0].tail(100)), 'Declined Students', 'Reds')
+
+    st.markdown("""
+    <div class="info-box">
+    <strong>📌 Distinctive Terms:</strong> Words are sized by how much more often one group uses them
+    than the other (smoothed log-odds ratio), not by raw frequency.
+    </div>
+    """, unsafe_allow_html=True)
+
+# ==================== COHORT SLICING ====================
+
+MAX_GROUP_VALUES = 30
+
+GROUP_KEYWORDS = ('course', 'program', 'section', 'semester', 'batch', 'year')
+
+def detect_group_columns(df):
+    """Detect course/program and other categorical columns usable as cohort filters"""
+    skip = {detect_email_column(df), detect_name_column(df)}
+    group_cols = []
+    for col in df.columns:
+        named = any(k in col.lower() for k in GROUP_KEYWORDS)
+        if col in skip or (pd.api.types.is_numeric_dtype(df[col]) and not named):
+            continue
+        if 2 <= df[col].nunique() <= MAX_GROUP_VALUES:
+            group_cols.append(col)
+    return sorted(group_cols, key=lambda col: not any(k in col.lower() for k in GROUP_KEYWORDS))
+
+def group_labels(series):
+    """String group labels with missing values made explicit"""
+    return series.astype(object).where(series.notna(), '(blank)').astype(str).to_numpy()
+
+def cohort_parts(df, pre_col, post_col):
+    """Per-row additive quantities from which cohort aggregates are summed"""
+    nan = np.full(len(df), np.nan)
+    pre = df[pre_col].to_numpy(dtype=float) if pre_col else nan
+    post = df[post_col].to_numpy(dtype=float) if post_col else nan
+    improvement = post - pre
+    counts = {
+        'students': np.ones(len(df), dtype=bool), 'pre_n': ~np.isnan(pre), 'post_n': ~np.isnan(post),
+        'improved': improvement > 0, 'neutral': improvement == 0, 'declined': improvement < 0
+    }
+    parts = pd.DataFrame({name: mask.astype(np.int64) for name, mask in counts.items()})
+    parts['pre_sum'] = np.nan_to_num(pre)
+    parts['post_sum'] = np.nan_to_num(post)
+    return parts
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_group_columns(_df, version):
+    """Cohort filter columns of a dataset version"""
+    return tuple(detect_group_columns(_df))
+
+def patch_cohort_index(index, rows, columns, _df, key, pre_col, post_col, group_cols):
+    """Cohort index after an in-place row edit: re-sum only the edited rows, keep group positions"""
+    if not columns.isdisjoint(group_cols):
+        return None
+    old = index['parts'].iloc[rows].reset_index(drop=True)
+    new = cohort_parts(_df.iloc[rows], pre_col, post_col)
+    change = new - old
+    parts = index['parts'].copy()
+    for name in parts.columns:
+        values = parts[name].to_numpy(copy=True)
+        values[rows] = new[name].to_numpy()
+        parts[name] = values
+    patched = {'parts': parts, 'totals': index['totals'] + change.sum(), 'groups': {}}
+    for col in group_cols:
+        group = index['groups'][col]
+        labels = group_labels(_df[col].iloc[rows])
+        patched['groups'][col] = {
+            'positions': group['positions'],
+            'stats': group['stats'] + change.groupby(labels).sum().reindex(group['stats'].index, fill_value=0)
+        }
+    return patched
+
+@tracked_resource(max_entries=8, patch=patch_cohort_index)
+def get_cohort_index(_df, key, pre_col, post_col, group_cols):
+    """Row positions and summed aggregates per group, rebuilt only when their columns change"""
+    parts = cohort_parts(_df, pre_col, post_col)
+    index = {'parts': parts, 'totals': parts.sum(), 'groups': {}}
+    for col in group_cols:
+        labels = group_labels(_df[col])
+        index['groups'][col] = {
+            'positions': pd.Series(labels).groupby(labels).indices,
+            'stats': parts.groupby(labels).sum()
+        }
+    return index
+
+def select_cohort(cohort_index, filters):
+    """Row positions and aggregates for the active filters (None positions means everyone)"""
+    active = {col: values for col, values in filters.items() if values}
+    if not active:
+        return None, cohort_index['totals']
+    groups = cohort_index['groups']
+    position_sets = [np.concatenate([groups[col]['positions'][v] for v in values])
+                     for col, values in active.items()]
+    if len(active) == 1:
+        col, values = next(iter(active.items()))
+        return np.sort(position_sets[0]), groups[col]['stats'].loc[values].sum()
+    positions = position_sets[0]
+    for other in position_sets[1:]:
+        positions = np.intersect1d(positions, other, assume_unique=True)
+    return positions, cohort_index['parts'].iloc[positions].sum()
+
+def summarize_cohort(stats):
+    """Overview metrics from summed cohort aggregates"""
+    avg_pre = stats['pre_sum'] / stats['pre_n'] if stats['pre_n'] else np.nan
+    avg_post = stats['post_sum'] / stats['post_n'] if stats['post_n'] else np.nan
+    return {
+        'students': int(stats['students']),
+        'avg_pre': avg_pre,
+        'avg_post': avg_post,
+        'avg_improvement': avg_post - avg_pre,
+        'improved': int(stats['improved']),
+        'neutral': int(stats['neutral']),
+        'declined': int(stats['declined'])
+    }
+
+def show_cohort_filters(cohort_index):
+    """Render cohort filters and return the selected row positions and aggregates"""
+    groups = cohort_index['groups']
+    filters = {}
+    if groups:
+        with st.expander("🎯 Cohort Filters", expanded=False):
+            columns = st.columns(min(len(groups), 3))
+            for i, (col, group) in enumerate(groups.items()):
+                with columns[i % len(columns)]:
+                    filters[col] = st.multiselect(col, sorted(group['positions']), key=f"cohort_{col}")
+    positions, stats = select_cohort(cohort_index, filters)
+    if positions is not None:
+        st.info(f"🎯 Showing {int(stats['students'])} of {int(cohort_index['totals']['students'])} students")
+    return positions, stats
+
+# ==================== APPROXIMATE ANALYTICS ====================
+
+SAMPLE_SIZE = int(os.environ.get('DASHBOARD_SAMPLE_SIZE', '20000'))
+
+MIN_STRATUM_SAMPLE = 50
+
+APPROX_DEFAULT_ROWS = 500000
+
+Z_95 = 1.96
+
+def build_stratified_sample(df, seed=0):
+    """Stratified reservoir sample: per stratum, the rows holding the smallest random priorities"""
+    n = len(df)
+    group_cols = detect_group_columns(df)
+    strata_col = group_cols[0] if group_cols else None
+    if strata_col:
+        codes, strata = pd.factorize(group_labels(df[strata_col]))
+    else:
+        codes, strata = np.zeros(n, dtype=np.int64), np.array(['All'])
+    sizes = np.bincount(codes, minlength=len(strata))
+    # Proportional allocation keeps the sample close to self-weighting; small strata get a floor
+    target = np.maximum(np.round(SAMPLE_SIZE * sizes / max(n, 1)), MIN_STRATUM_SAMPLE)
+    allocation = np.minimum(sizes, target).astype(np.int64)
+    order = np.lexsort((np.random.default_rng(seed).random(n), codes))
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    within = np.arange(n) - offsets[codes[order]]
+    positions = np.sort(order[within < allocation[codes[order]]])
+    return {
+        'positions': positions,
+        'weights': (sizes / np.maximum(allocation, 1))[codes[positions]],
+        'strata_col': strata_col,
+        'population': n,
+        'strata': pd.DataFrame({'Stratum': strata, 'Population': sizes, 'Sampled': allocation})
+    }
+
+@tracked_resource(max_entries=4)
+def get_stratified_sample(_df, version):
+    """The sample drawn at ingest for the published version, or one drawn now for any other"""
+    store = get_dataset_store()
+    if store['version'] == version and store.get('sample') is not None:
+        return store['sample']
+    sample = build_stratified_sample(_df)
+    return sample
+
+def sample_cohort(sample, positions):
+    """Sampled rows inside a cohort, with weights rescaled to the cohort's size"""
+    if positions is None:
+        return sample['positions'], sample['weights']
+    member = np.zeros(sample['population'], dtype=bool)
+    member[positions] = True
+    inside = member[sample['positions']]
+    rows, weights = sample['positions'][inside], sample['weights'][inside]
+    if weights.size:
+        weights = weights * len(positions) / weights.sum()
+    return rows, weights
+
+def weighted_estimate(values, weights):
+    """Weighted mean of a sampled quantity and its 95% confidence half-width"""
+    valid = ~np.isnan(values)
+    values, weights = values[valid], weights[valid]
+    if values.size < 2:
+        return (values.mean() if values.size else np.nan), np.nan
+    mean = np.average(values, weights=weights)
+    variance = np.sum((weights * (values - mean)) ** 2) / weights.sum() ** 2 * values.size / (values.size - 1)
+    return mean, Z_95 * np.sqrt(variance)
+
+def estimate_cohort(df, weights, pre_col, post_col, students):
+    """Overview metrics and their 95% half-widths, estimated from a cohort's sampled rows"""
+    nan = np.full(len(df), np.nan)
+    pre = df[pre_col].to_numpy(dtype=float) if pre_col else nan
+    post = df[post_col].to_numpy(dtype=float) if post_col else nan
+    improvement = post - pre
+    estimates, intervals = {'students': students}, {}
+    estimates['avg_pre'], intervals['avg_pre'] = weighted_estimate(pre, weights)
+    estimates['avg_post'], intervals['avg_post'] = weighted_estimate(post, weights)
+    estimates['avg_improvement'] = estimates['avg_post'] - estimates['avg_pre']
+    # Ignores the pre/post covariance, so the interval is conservative for positively correlated tests
+    intervals['avg_improvement'] = np.hypot(intervals['avg_pre'], intervals['avg_post'])
+    for name, mask in (('improved', improvement > 0), ('neutral', improvement == 0), ('declined', improvement < 0)):
+        share, half_width = weighted_estimate(mask.astype(float), weights)
+        estimates[name] = int(round(share * students)) if not np.isnan(share) else 0
+        intervals[name] = half_width * students
+    return estimates, intervals
+
+def estimate_category_shares(improvement, weights):
+    """Estimated share of each improvement category and its 95% half-width"""
+    codes = categorize_improvements(improvement)
+    known = codes >= 0
+    shares, half_widths = np.zeros(len(IMPROVEMENT_CATEGORIES)), np.zeros(len(IMPROVEMENT_CATEGORIES))
+    for code in range(len(IMPROVEMENT_CATEGORIES)):
+        shares[code], half_widths[code] = weighted_estimate((codes[known] == code).astype(float), weights[known])
+    return np.nan_to_num(shares), np.nan_to_num(half_widths)
+
+def correlation_intervals(correlation, n):
+    """95% half-widths of sample correlations via the Fisher z-transform"""
+    z = np.arctanh(np.clip(correlation, -0.999999, 0.999999))
+    spread = Z_95 / np.sqrt(max(n - 3, 1))
+    return (np.tanh(z + spread) - np.tanh(z - spread)) / 2
+
+def format_interval(half_width, fmt='{:.1f}%'):
+    """'± x' line shown under a metric card value in approximate mode"""
+    if half_width is None or np.isnan(half_width):
+        return ''
+    return f"<p>± {fmt.format(half_width)} (95% CI)</p>"
+
+def show_approximate_toggle(rows):
+    """Offer sampled analytics on large datasets; returns whether approximate mode is on"""
+    if rows <= SAMPLE_SIZE:
+        return False
+    return st.toggle("⚡ Approximate mode", value=rows >= APPROX_DEFAULT_ROWS, key="approx_mode",
+                     help=f"Compute overview metrics and charts from a stratified sample of about "
+                          f"{SAMPLE_SIZE:,} rows with 95% confidence intervals. Turn off for exact figures.")
+
+# ==================== ANOMALY FLAGS ====================
+
+ROBUST_Z_THRESHOLD = 3.5
+
+# Robust spread never below a few score points, so a near-uniform course doesn't flag a 1-point difference
+MIN_JUMP_SPREAD = 5.0
+
+# Courses with fewer complete pre/post pairs are too small for a median/MAD baseline
+MIN_JUMP_COURSE_SIZE = 5
+
+SCORE_RANGE = (0, 100)
+
+ANOMALY_CHECKS = ['Unusual jump', 'Score out of range', 'Missing pre/post', 'Duplicate email']
+
+ANOMALY_PREVIEW_ROWS = 500
+
+def anomaly_columns(df, pre_col, post_col, group_cols):
+    """Pre, post, course, email and score columns the anomaly checks read"""
+    course_col = next((col for col in group_cols if 'course' in col.lower() or 'program' in col.lower()), None)
+    score_cols = tuple(col for col in df.columns
+                       if 'score' in col.lower() and pd.api.types.is_numeric_dtype(df[col]))
+    return pre_col, post_col, course_col, detect_email_column(df), score_cols
+
+def anomaly_key(column_versions, columns):
+    """Cache key covering the content of every column the anomaly checks read"""
+    *named, score_cols = columns
+    return columns_version(column_versions, [*named, *score_cols])
+
+def detect_anomalies(df, pre_col, post_col, course_col, email_col, score_cols):
+    """Per-row check bits (ANOMALY_CHECKS order) and robust z-score of improvement within each course"""
+    nan = np.full(len(df), np.nan)
+    pre = df[pre_col].to_numpy(dtype=float) if pre_col else nan
+    post = df[post_col].to_numpy(dtype=float) if post_col else nan
+    improvement = post - pre
+    codes = (pd.factorize(df[course_col], use_na_sentinel=False)[0] if course_col
+             else np.zeros(len(df), dtype=np.int64))
+    median = pd.Series(improvement).groupby(codes).transform('median').to_numpy()
+    deviation = np.abs(improvement - median)
+    mad = pd.Series(deviation).groupby(codes).transform('median').to_numpy()
+    # When most of a course shares one improvement the MAD is 0; scale by the mean absolute deviation instead
+    mean_deviation = pd.Series(deviation).groupby(codes).transform('mean').to_numpy()
+    spread = np.fmax(np.where(mad > 0, mad / 0.6745, 1.2533 * mean_deviation), MIN_JUMP_SPREAD)
+    robust_z = (improvement - median) / spread
+    pairs = pd.Series(improvement).groupby(codes).transform('count').to_numpy()
+    robust_z[pairs < MIN_JUMP_COURSE_SIZE] = np.nan
+
+    checks = [np.abs(robust_z) > ROBUST_Z_THRESHOLD]
+    scores = df[list(score_cols)].to_numpy(dtype=float)
+    checks.append(((scores < SCORE_RANGE[0]) | (scores > SCORE_RANGE[1])).any(axis=1))
+    checks.append(np.isnan(pre) | np.isnan(post) if pre_col and post_col else np.zeros(len(df), dtype=bool))
+    if email_col:
+        emails = normalize_emails(df[email_col])
+        checks.append((emails.duplicated(keep=False) & (emails != '')).to_numpy())
+    else:
+        checks.append(np.zeros(len(df), dtype=bool))
+    flags = np.zeros(len(df), dtype=np.uint8)
+    for bit, mask in enumerate(checks):
+        flags |= mask.astype(np.uint8) << bit
+    return {'flags': flags, 'robust_z': robust_z, 'improvement': improvement, 'course_col': course_col}
+
+@tracked_resource(max_entries=8)
+def get_anomalies(_df, key, columns):
+    """Anomaly flags stamped at ingest for the published version, or computed once here"""
+    store = get_dataset_store()
+    if store.get('anomalies') is not None and store['anomalies']['key'] == key:
+        return store['anomalies']
+    anomalies = dict(detect_anomalies(_df, *columns), key=key)
+    return anomalies
+
+def flag_labels(flags):
+    """Comma-separated check names for each row's flag bits"""
+    labels = np.full(len(flags), '', dtype=object)
+    for bit, check in enumerate(ANOMALY_CHECKS):
+        hit = (flags >> bit) & 1 == 1
+        labels[hit] = np.where(labels[hit] == '', check, labels[hit] + ', ' + check)
+    return labels
+
+@st.fragment
+def show_anomaly_flags(df, anomalies, columns, positions=None):
+    """Filterable list of flagged students in the cohort, most unusual improvement first"""
+    pre_col, post_col, course_col, email_col, _ = columns
+    flags = anomalies['flags'] if positions is None else anomalies['flags'][positions]
+    counts = [int(np.count_nonzero((flags >> bit) & 1)) for bit in range(len(ANOMALY_CHECKS))]
+    if not any(counts):
+        st.success("✅ No anomalies found in this cohort.")
+        return
+    st.caption(" · ".join(f"{check}: {count:,}" for check, count in zip(ANOMALY_CHECKS, counts)))
+    checks = st.multiselect("Show students flagged for", ANOMALY_CHECKS,
+                            default=[check for check, count in zip(ANOMALY_CHECKS, counts) if count],
+                            key="anomaly_checks")
+    mask = np.uint8(sum(1 << ANOMALY_CHECKS.index(check) for check in checks))
+    rows = np.flatnonzero(flags & mask)
+    if positions is not None:
+        rows = positions[rows]
+    if len(rows) == 0:
+        st.info("No students match the selected checks.")
+        return
+    order = np.argsort(-np.nan_to_num(np.abs(anomalies['robust_z'][rows]), nan=-1.0), kind='stable')
+    shown = rows[order[:ANOMALY_PREVIEW_ROWS]]
+    name_col = detect_name_column(df)
+    table = df.iloc[shown][[col for col in (name_col, email_col, course_col, pre_col, post_col) if col]]
+    table = table.assign(Improvement=anomalies['improvement'][shown],
+                         **{'Robust z': anomalies['robust_z'][shown], 'Flags': flag_labels(anomalies['flags'][shown])})
+    st.dataframe(table.round(2), use_container_width=True, hide_index=True)
+    if len(rows) > len(shown):
+        st.caption(f"Showing the {len(shown):,} most unusual of {len(rows):,} flagged students.")
+    st.caption(f"Unusual jump: improvement more than {ROBUST_Z_THRESHOLD} robust standard deviations "
+               f"(median/MAD, at least {MIN_JUMP_SPREAD:g} points) from the {course_col or 'class'} median; "
+               f"not checked in courses with fewer than {MIN_JUMP_COURSE_SIZE} complete pre/post pairs.")
+
+# ==================== LONGITUDINAL ANALYSIS ====================
+
+WAVE_KEYWORDS = (('baseline', 0), ('pre', 0), ('mid', 1), ('interim', 1), ('wave', 1), ('round', 1), ('post', 2))
+TRAJECTORY_SAMPLE = 100
+
+def wave_order(col):
+    """Sort key placing a score column named as a wave among baseline, middle and post waves
+
+    Only wave keywords make a column a wave; a number in the name orders waves of the same
+    rank (Wave1, Wave2), so Q1Score or FinalProjectScore are never taken for one.
+    """
+    name = col.lower()
+    rank = next((r for keyword, r in WAVE_KEYWORDS if keyword in name), None)
+    if rank is None:
+        return None
+    number = re.search(r'\d+', name)
+    return (rank, int(number.group()) if number else 0)
+
+def detect_wave_columns(df):
+    """Dynamically detect ordered assessment wave score columns"""
+    candidates = [(wave_order(col), col) for col in df.columns
+                  if 'score' in col.lower() and pd.api.types.is_numeric_dtype(df[col])]
+    return [col for order, col in sorted((c for c in candidates if c[0] is not None), key=lambda c: c[0])]
+
+def fit_wave_columns(df, configured):
+    """Configured wave order if it fits this dataset, otherwise the detected one"""
+    if configured and all(col in df.columns for col in configured):
+        return list(configured)
+    return detect_wave_columns(df)
+
+def get_wave_columns(df):
+    """Admin-configured wave order if it fits this dataset, otherwise the detected one"""
+    return fit_wave_columns(df, st.session_state.wave_columns)
+
+def get_test_columns(df, configured):
+    """Pre-Test/Post-Test columns: the first and last waves the admin configured, otherwise detected by name"""
+    if configured and len(configured) >= 2 and all(col in df.columns for col in configured):
+        return [configured[0]], [configured[-1]]
+    return detect_test_columns(df)
+
+def compute_trajectories(scores):
+    """Per-student least-squares slopes and wave-over-wave deltas from a students x waves matrix"""
+    x = np.arange(scores.shape[1], dtype=float)
+    observed = ~np.isnan(scores)
+    xs = np.where(observed, x, 0.0)
+    ys = np.where(observed, scores, 0.0)
+    n = observed.sum(axis=1)
+    sx, sy = xs.sum(axis=1), ys.sum(axis=1)
+    denom = n * (xs ** 2).sum(axis=1) - sx ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = np.where(denom > 0, (n * (xs * ys).sum(axis=1) - sx * sy) / denom, np.nan)
+    return {'scores': scores, 'slopes': slopes, 'deltas': np.diff(scores, axis=1), 'observed': n}
+
+@tracked_resource(max_entries=8)
+def get_trajectories(_df, key, waves):
+    """Student trajectories for the given waves, rebuilt only when a wave column changes"""
+    trajectories = compute_trajectories(_df[list(waves)].to_numpy(dtype=float))
+    return trajectories
+
+def summarize_waves(trajectories, positions=None):
+    """Class means, spread, wave-over-wave deltas and linear trend for a cohort"""
+    pick = (lambda a: a) if positions is None else (lambda a: a[positions])
+    scores, deltas, slopes = pick(trajectories['scores']), pick(trajectories['deltas']), pick(trajectories['slopes'])
+    means = np.nanmean(scores, axis=0)
+    valid = ~np.isnan(means)
+    x = np.arange(scores.shape[1], dtype=float)
+    trend = np.polyfit(x[valid], means[valid], 1) if valid.sum() >= 2 else np.array([np.nan, np.nan])
+    delta_counts = (~np.isnan(deltas)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        improved_share = (deltas > 0).sum(axis=0) / delta_counts
+    return {
+        'means': means,
+        'stds': np.nanstd(scores, axis=0),
+        'counts': (~np.isnan(scores)).sum(axis=0),
+        'mean_deltas': np.nanmean(deltas, axis=0),
+        'improved_share': improved_share,
+        'delta_counts': delta_counts,
+        'trend': trend,
+        'slopes': slopes
+    }
+
+def show_longitudinal_analysis(df, version, waves, positions=None):
+    """Class trend across assessment waves with sampled student trajectories"""
+    trajectories = get_trajectories(df, columns_version(get_column_versions(df, version), waves), tuple(waves))
+    summary = summarize_waves(trajectories, positions)
+    x = np.arange(len(waves))
+    chart_key = (version, tuple(waves), 'all' if positions is None else hashlib.sha1(positions.tobytes()).hexdigest())
+
+    st.markdown("---")
+    st.markdown(f"## 📅 Longitudinal Trends ({len(waves)} Assessment Waves)")
+    col1, col2 = st.columns(2)
+    with col1:
+        def draw_trend():
+            fig, ax = plt.subplots(figsize=(10, 6))
+            scores = trajectories['scores'] if positions is None else trajectories['scores'][positions]
+            if len(scores) > TRAJECTORY_SAMPLE:
+                scores = scores[np.random.default_rng(0).choice(len(scores), TRAJECTORY_SAMPLE, replace=False)]
+            ax.plot(x, scores.T, color='#94a3b8', alpha=0.25, linewidth=1)
+            ax.fill_between(x, summary['means'] - summary['stds'], summary['means'] + summary['stds'],
+                            color='#667eea', alpha=0.15, label='±1 SD')
+            ax.plot(x, summary['means'], marker='o', color='#667eea', linewidth=3, label='Class Average')
+            ax.plot(x, np.polyval(summary['trend'], x), linestyle='--', color='#ef4444',
+                    label=f"Trend ({summary['trend'][0]:+.1f}%/wave)")
+            ax.set_xticks(x)
+            ax.set_xticklabels(waves, rotation=20)
+            ax.set_ylabel('Score (%)', fontsize=12, fontweight='bold')
+            ax.set_title('Class Trend Across Waves', fontsize=14, fontweight='bold', pad=20)
+            ax.legend()
+            ax.grid(axis='y', alpha=0.3)
+            return fig
+
+        show_chart((*chart_key, 'trend'), draw_trend)
+    with col2:
+        def draw_slopes():
+            fig, ax = plt.subplots(figsize=(10, 6))
+            slopes = summary['slopes'][~np.isnan(summary['slopes'])]
+            ax.hist(slopes, bins=30, color='#10b981', alpha=0.8, edgecolor='black')
+            ax.axvline(x=0, color='black', linestyle='--', linewidth=1)
+            ax.set_xlabel('Score Change per Wave (%)', fontsize=12, fontweight='bold')
+            ax.set_ylabel('Students', fontsize=12, fontweight='bold')
+            ax.set_title('Distribution of Student Slopes', fontsize=14, fontweight='bold', pad=20)
+            ax.grid(axis='y', alpha=0.3)
+            return fig
+
+        show_chart((*chart_key, 'slopes'), draw_slopes)
+
+    st.markdown("### 🔁 Wave-over-Wave Change")
+    st.dataframe(pd.DataFrame({
+        'From': waves[:-1],
+        'To': waves[1:],
+        'Avg Change': summary['mean_deltas'],
+        'Improved': summary['improved_share'],
+        'Students': summary['delta_counts']
+    }).style.format({'Avg Change': '{:+.1f}%', 'Improved': '{:.0%}'}), hide_index=True, use_container_width=True)
+    st.markdown("""
+    <div class="info-box">
+    <strong>📌 Reading Trajectories:</strong> Each grey line is one student. The slope is the
+    least-squares score change per wave, using every wave the student attempted.
+    </div>
+    """, unsafe_allow_html=True)
+
+def show_student_trajectory(position, waves):
+    """A student's scores across all waves against the class average"""
+    df = st.session_state.uploaded_data
+    trajectories = get_trajectories(df, columns_version(get_column_versions(df, get_dataset_version()), waves),
+                                    tuple(waves))
+    summary = summarize_waves(trajectories)
+    scores = trajectories['scores'][position]
+    slope = trajectories['slopes'][position]
+
+    st.markdown("---")
+    st.markdown("### 📅 Your Progress Across All Tests")
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        fig, ax = plt.subplots(figsize=(10, 5))
+        x = np.arange(len(waves))
+        ax.plot(x, scores, marker='o', color='#667eea', linewidth=3, label='Your Scores')
+        ax.plot(x, summary['means'], marker='s', color='#f59e0b', linestyle='--', label='Class Average')
+        ax.set_xticks(x)
+        ax.set_xticklabels(waves, rotation=20)
+        ax.set_ylabel('Score (%)', fontsize=12, fontweight='bold')
+        ax.set_title('Your Trajectory', fontsize=14, fontweight='bold', pad=20)
+        ax.legend()
+        ax.grid(axis='y', alpha=0.3)
+        st.pyplot(fig)
+        plt.close()
+    with col2:
+        st.markdown(f"""
+            <div class="metric-card">
+                <h4>📈 Your Trend</h4>
+                <h1>{slope:+.1f}%</h1>
+                <p>per test (class: {np.nanmean(summary['slopes']):+.1f}%)</p>
+            </div>
+        """, unsafe_allow_html=True)
+
+@st.fragment
+def show_wave_editor(df):
+    """Let the admin confirm or reorder the assessment waves"""
+    with st.expander("📅 Assessment Waves"):
+        numeric_cols = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col])]
+        selected = st.multiselect("Score columns in chronological order", numeric_cols,
+                                  default=get_wave_columns(df), key="wave_editor")
+        st.caption("The first wave is treated as the Pre-Test and the last as the Post-Test.")
+        if st.button("✅ Save Wave Order"):
+            set_wave_columns(selected or None)
+            st.rerun()
+
+# ==================== DATASET BROWSER ====================
+
+ALL_COLUMNS = "All columns"
+PAGE_SIZES = [25, 50, 100, 250]
+
+@tracked_resource(max_entries=64)
+def get_sort_order(_df, column_version, column):
+    """Stable ascending row order for a column with missing values last"""
+    series = _df[column]
+    try:
+        codes, _ = pd.factorize(series, sort=True)
+    except TypeError:
+        codes, _ = pd.factorize(series.astype(str).where(series.notna()), sort=True)
+    codes = np.where(codes < 0, np.iinfo(codes.dtype).max, codes)
+    sort = {'order': np.argsort(codes, kind='stable'), 'valid': int(series.notna().sum())}
+    return sort
+
+def search_text(series):
+    """Case-folded text of values for substring search, missing as empty"""
+    return series.astype(str).where(series.notna(), '').str.casefold()
+
+def patch_search_index(index, rows, columns, _df, column_version, column):
+    """Search index after an in-place row edit, re-folding only the edited rows"""
+    patched = index.copy()
+    patched.iloc[rows] = search_text(_df[column].iloc[rows]).to_numpy()
+    return patched
+
+@tracked_resource(max_entries=64, patch=patch_search_index)
+def get_search_index(_df, column_version, column):
+    """Case-folded text of a column for substring search"""
+    index = search_text(_df[column]).reset_index(drop=True)
+    return index
+
+def patch_row_search_index(index, rows, columns, _df, version):
+    """Row search index after an in-place row edit, re-joining only the edited rows"""
+    if not len(_df.columns):
+        return None
+    versions = get_column_versions(_df, version)
+    parts = [get_search_index(_df, versions[col], col).iloc[rows] for col in _df.columns]
+    patched = index.copy()
+    patched.iloc[rows] = parts[0].str.cat(parts[1:], sep='\x1f').to_numpy()
+    return patched
+
+@tracked_resource(max_entries=8, patch=patch_row_search_index)
+def get_row_search_index(_df, version):
+    """Case-folded text of whole rows, joined from the per-column indexes"""
+    versions = get_column_versions(_df, version)
+    columns = [get_search_index(_df, versions[col], col) for col in _df.columns]
+    index = columns[0].str.cat(columns[1:], sep='\x1f') if columns else pd.Series([''] * len(_df))
+    return index
+
+def browse_positions(df, version, search, search_column, sort_column, descending, subset=None):
+    """Row positions matching the search, in the requested sort order"""
+    mask = None
+    if subset is not None:
+        mask = np.zeros(len(df), dtype=bool)
+        mask[subset] = True
+    versions = get_column_versions(df, version)
+    if search:
+        if search_column == ALL_COLUMNS:
+            index = get_row_search_index(df, version)
+        else:
+            index = get_search_index(df, versions[search_column], search_column)
+        matches = index.str.contains(search.casefold(), regex=False).to_numpy()
+        mask = matches if mask is None else mask & matches
+
+    if sort_column is None:
+        return np.arange(len(df)) if mask is None else np.flatnonzero(mask)
+    sort = get_sort_order(df, versions[sort_column], sort_column)
+    order = sort['order']
+    if descending:
+        order = np.concatenate([order[:sort['valid']][::-1], order[sort['valid']:]])
+    return order if mask is None else order[mask[order]]
+
+@st.fragment
+def show_dataset_browser(df, version, key, subset=None):
+    """Paginated, sortable, searchable table that sends one page of rows at a time"""
+    col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
+    with col1:
+        search = st.text_input("🔎 Search", key=f"{key}_search", placeholder="Type to filter rows")
+    with col2:
+        search_column = st.selectbox("Search in", [ALL_COLUMNS] + list(df.columns), key=f"{key}_search_col")
+    with col3:
+        sort_column = st.selectbox("Sort by", ["(original order)"] + list(df.columns), key=f"{key}_sort")
+    with col4:
+        descending = st.checkbox("Desc", key=f"{key}_desc")
+
+    positions = browse_positions(df, version, search.strip(), search_column,
+                                 None if sort_column == "(original order)" else sort_column,
+                                 descending, subset)
+    total = len(positions)
+
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size")
+    pages = max(1, -(-total // page_size))
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    with col2:
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key=f"{key}_page")
+    page = min(int(page), pages)
+    start = (page - 1) * page_size
+    page_rows = df.iloc[positions[start:start + page_size]]
+
+    st.dataframe(page_rows, use_container_width=True)
+    with col3:
+        st.caption(f"Rows {start + 1 if total else 0}–{start + len(page_rows)} of {total} · page {page}/{pages}")
+
+# ==================== UPLOAD DIFFING ====================
+
+DIFF_PREVIEW_ROWS = 100
+ROW_PATCH_MAX_FRACTION = 0.2
+
+def normalize_emails(series):
+    """Emails as matched at login: stripped and lower-cased, missing as empty"""
+    return series.astype(str).where(series.notna(), '').str.strip().str.lower()
+
+def compute_row_keys(df, row_hashes, by_email=True):
+    """Row identities for diffing: normalized email, numbered among duplicates, or row content"""
+    email_col = detect_email_column(df) if by_email else None
+    key = normalize_emails(df[email_col]) if email_col else pd.Series(row_hashes)
+    key = key.reset_index(drop=True)
+    return pd.DataFrame({'key': key, 'n': key.groupby(key).cumcount(), 'position': np.arange(len(df))})
+
+def changed_values(old, new):
+    """Element-wise inequality of two aligned columns, treating missing as equal"""
+    old, new = pd.Series(old).reset_index(drop=True), pd.Series(new).reset_index(drop=True)
+    equal = old.to_numpy(dtype=object) == new.to_numpy(dtype=object)
+    return ~(equal | (old.isna() & new.isna()).to_numpy())
+
+def diff_datasets(old_df, old_hashes, new_df, new_hashes, aligned=False):
+    """Added, removed and modified rows of an upload against the published dataset
+
+    Rows are paired on normalized email (the n-th duplicate with the n-th) when both
+    sides have an email column, otherwise on content, in which case a modified row
+    shows up as one removal plus one addition. ``aligned`` says the email column is
+    unchanged, so rows pair by position without a join.
+    """
+    keyed = bool(detect_email_column(old_df) and detect_email_column(new_df))
+    if aligned and keyed:
+        positions = pd.Series(np.arange(len(new_df)))
+        pairs = pd.DataFrame({'position_old': positions, 'position_new': positions})
+    else:
+        old_keys = compute_row_keys(old_df, old_hashes, keyed)
+        new_keys = compute_row_keys(new_df, new_hashes, keyed)
+        pairs = old_keys.merge(new_keys, on=['key', 'n'], how='outer', suffixes=('_old', '_new'))
+    matched = pairs.dropna(subset=['position_old', 'position_new'])
+    old_pos = matched['position_old'].to_numpy(dtype=np.int64)
+    new_pos = matched['position_new'].to_numpy(dtype=np.int64)
+
+    # Row hashes are comparable only under the same column layout; otherwise compare values
+    common = [col for col in new_df.columns if col in old_df.columns]
+    if list(old_df.columns) == list(new_df.columns):
+        candidates = old_hashes[old_pos] != new_hashes[new_pos]
+    else:
+        candidates = np.ones(len(old_pos), dtype=bool)
+    old_pos, new_pos = old_pos[candidates], new_pos[candidates]
+
+    modified = np.zeros(len(old_pos), dtype=bool)
+    column_changes = []
+    for col in common:
+        changed = changed_values(old_df[col].iloc[old_pos], new_df[col].iloc[new_pos])
+        modified |= changed
+        if changed.any():
+            first = np.flatnonzero(changed)[0]
+            column_changes.append({'Column': col, 'Change': 'values', 'Rows': int(changed.sum()),
+                                   'Example': f"{old_df[col].iloc[old_pos[first]]} → {new_df[col].iloc[new_pos[first]]}"})
+    for col in new_df.columns.difference(old_df.columns, sort=False):
+        column_changes.append({'Column': col, 'Change': 'added column', 'Rows': len(new_df), 'Example': ''})
+    for col in old_df.columns.difference(new_df.columns, sort=False):
+        column_changes.append({'Column': col, 'Change': 'removed column', 'Rows': len(old_df), 'Example': ''})
+
+    removed = pairs.loc[pairs['position_new'].isna(), 'position_old'].to_numpy(dtype=np.int64)
+    email_col = detect_email_column(old_df) if keyed else None
+    return {
+        'keyed': keyed,
+        'aligned': aligned and keyed,
+        'added': np.sort(pairs.loc[pairs['position_old'].isna(), 'position_new'].to_numpy(dtype=np.int64)),
+        'removed': np.sort(removed),
+        'removed_keys': old_df[email_col].iloc[np.sort(removed)[:DIFF_PREVIEW_ROWS]].tolist() if email_col else [],
+        'modified': np.sort(new_pos[modified]),
+        'unchanged': len(matched) - int(modified.sum()),
+        'columns': pd.DataFrame(column_changes, columns=['Column', 'Change', 'Rows', 'Example'])
+    }
+
+def row_delta(diff, published, df, column_versions):
+    """Rows and columns an upload edited in place, so derived indexes can be patched instead of rebuilt
+
+    Only for uploads that pair with the published rows by position (same emails in the same
+    order, same columns and dtypes) and change few enough rows that patching beats rebuilding.
+    """
+    if diff is None or not diff['aligned'] or len(diff['added']) or len(diff['removed']):
+        return None
+    old_df = published['data']
+    if not old_df.dtypes.equals(df.dtypes) or len(diff['modified']) > ROW_PATCH_MAX_FRACTION * len(df):
+        return None
+    columns = frozenset(col for col in df.columns if published['column_versions'][col] != column_versions[col])
+    return {'base': published['version'], 'rows': diff['modified'], 'columns': columns}
+
+@tracked_resource(max_entries=8)
+def get_student_index(_df, email_version, email_col):
+    """Normalized email index for per-student lookups, rebuilt only when the email column changes"""
+    index = pd.Index(normalize_emails(_df[email_col]))
+    return index
+
+def find_student_rows(df, email):
+    """A student's rows in the active dataset by normalized email"""
+    email_col = detect_email_column(df)
+    if not email_col or not email:
+        return df.iloc[:0]
+    version = get_column_versions(df, get_dataset_version())[email_col]
+    positions = get_student_index(df, version, email_col).get_indexer_for([email.strip().lower()])
+    return df.iloc[positions[positions >= 0]]
+
+def show_upload_diff(diff, df):
+    """Rows and columns an upload changed relative to the previously published dataset"""
+    if diff is None:
+        return
+    st.markdown("### 🔁 Changes vs Published Dataset")
+    if diff.get('identical'):
+        st.info("No changes: this upload matches the published dataset, so every cached result was kept.")
+        return
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Added", len(diff['added']))
+    col2.metric("Removed", len(diff['removed']))
+    col3.metric("Modified", len(diff['modified']))
+    col4.metric("Unchanged", diff['unchanged'])
+    if not diff['keyed']:
+        st.caption("No email column on both sides; rows were matched by content, so edits count as "
+                   "one removal plus one addition.")
+    if not diff['columns'].empty:
+        st.dataframe(diff['columns'], hide_index=True, use_container_width=True)
+    for label, positions in (("Modified rows", diff['modified']), ("Added rows", diff['added'])):
+        if len(positions):
+            with st.expander(f"{label} ({len(positions)})"):
+                st.dataframe(df.iloc[positions[:DIFF_PREVIEW_ROWS]], use_container_width=True)
+    if diff['removed_keys']:
+        with st.expander(f"Removed rows ({len(diff['removed'])})"):
+            st.write(", ".join(map(str, diff['removed_keys'])))
+
+# ==================== BACKGROUND JOBS ====================
+
+JOB_WORKERS = 4
+JOB_RETENTION_SECONDS = 3600
+MAX_RETAINED_JOBS = 100
+CSV_CHUNK_ROWS = 50000
+
+class JobCancelled(Exception):
+    """Raised inside a task when its job has been cancelled"""
+
+class Job:
+    """A unit of background work with progress, cancellation and a retained result"""
+
+    def __init__(self, key, label):
+        self.id = uuid.uuid4().hex[:8]
+        self.key = key
+        self.label = label
+        self.status = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def update(self, progress, message=''):
+        """Report progress from inside a task; raises JobCancelled once cancelled"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.progress = min(max(float(progress), 0.0), 1.0)
+        self.message = message
+
+    def cancel(self):
+        """Request cancellation; queued jobs never start, running jobs stop at the next update"""
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self.status = 'cancelled'
+            self.finished = time.time()
+
+class JobQueue:
+    """In-process job queue backed by a worker thread pool"""
+
+    def __init__(self, workers):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dashboard-job')
+        self._jobs = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, label, fn, *args):
+        """Run fn(job, *args) in the background, reusing any retained job with the same key
+
+        Failed and cancelled jobs are reused too, so a rerun shows their status instead of
+        starting over; ``discard`` (the Retry button) is what lets the next submit run again.
+        """
+        with self._lock:
+            self._prune()
+            existing = self._jobs.get(self._keys.get(key))
+            if existing is not None:
+                return existing
+            job = Job(key, label)
+            self._jobs[job.id] = job
+            self._keys[key] = job.id
+            job.future = self._executor.submit(self._run, job, fn, args)
+            return job
+
+    def get(self, job_id):
+        """Look up a retained job by id"""
+        return self._jobs.get(job_id)
+
+    def find(self, key):
+        """The retained job for a key, if any, without submitting one"""
+        with self._lock:
+            return self._jobs.get(self._keys.get(key))
+
+    def discard(self, job_id):
+        """Drop a finished job and its result so the next submit recomputes it"""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is not None and self._keys.get(job.key) == job_id:
+                del self._keys[job.key]
+
+    def jobs(self):
+        """All retained jobs, newest first"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return sorted(jobs, key=lambda job: job.created, reverse=True)
+
+    def _run(self, job, fn, args):
+        if job._cancel.is_set():
+            job.status = 'cancelled'
+            job.finished = time.time()
+            return
+        job.status = 'running'
+        try:
+            job.result = fn(job, *args)
+            job.progress = 1.0
+            job.status = 'done'
+            get_memory_manager().track(('job', job.id), 'Export buffers & job results', job.result,
+                                       release=partial(self.discard, job.id))
+        except JobCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished = time.time()
+
+    def _prune(self):
+        finished = sorted((job for job in self._jobs.values() if not job.active), key=lambda job: job.finished)
+        expired = [job for job in finished if time.time() - job.finished > JOB_RETENTION_SECONDS]
+        expired += finished[len(expired):max(len(expired), len(self._jobs) - MAX_RETAINED_JOBS)]
+        for job in expired:
+            del self._jobs[job.id]
+            if self._keys.get(job.key) == job.id:
+                del self._keys[job.key]
+            get_memory_manager().forget(('job', job.id))
+
+@st.cache_resource
+def get_job_queue():
+    """Process-wide background job queue shared by all sessions"""
+    return JobQueue(JOB_WORKERS)
+
+def process_upload_task(job, data, answer_keys, published):
+    """Parse an uploaded CSV in chunks, apply answer keys, stamp a version, check it and diff it against the published one"""
+    buffer = BytesIO(data)
+    chunks = []
+    for chunk in pd.read_csv(buffer, chunksize=CSV_CHUNK_ROWS):
+        chunks.append(chunk)
+        job.update(0.7 * buffer.tell() / max(len(data), 1), f"Parsed {sum(map(len, chunks))} rows")
+    df = clean_column_names(pd.concat(chunks, ignore_index=True) if chunks else pd.read_csv(BytesIO(data)))
+    item_statistics = {}
+    if answer_keys:
+        job.update(0.75, "Scoring answer keys")
+        df, item_statistics = apply_answer_keys(df, answer_keys)
+    job.update(0.8, "Hashing rows")
+    column_hashes = hash_columns(df)
+    row_hashes = compute_row_hashes(df, column_hashes)
+    version = compute_dataset_version(df, row_hashes)
+    column_versions = compute_column_versions(df, column_hashes)
+    if published['version'] == version:
+        # Re-publishing the same export: hand back the published objects so every cache still hits
+        return {'data': published['data'], 'item_statistics': item_statistics, 'version': version,
+                'sample': published['sample'], 'row_hashes': published['row_hashes'],
+                'column_versions': published['column_versions'], 'anomalies': published['anomalies'],
+                'delta': None, 'diff': {'identical': True}}
+
+    diff = None
+    if published['data'] is not None:
+        job.update(0.85, "Diffing against the published dataset")
+        published_hashes = published['row_hashes']
+        if published_hashes is None:
+            published_hashes = compute_row_hashes(published['data'])
+        email_col = detect_email_column(df)
+        aligned = (published['column_versions'] is not None and email_col is not None
+                   and published['column_versions'].get(email_col) == column_versions[email_col])
+        diff = diff_datasets(published['data'], published_hashes, df, row_hashes, aligned)
+    job.update(0.9, "Drawing analysis sample")
+    sample = build_stratified_sample(df)
+    job.update(0.95, "Checking for anomalies")
+    pre_cols, post_cols = get_test_columns(df, published['wave_columns'])
+    columns = anomaly_columns(df, next(iter(pre_cols), None), next(iter(post_cols), None), detect_group_columns(df))
+    anomalies = dict(detect_anomalies(df, *columns), key=anomaly_key(column_versions, columns))
+    return {'data': df, 'item_statistics': item_statistics, 'version': version, 'sample': sample,
+            'row_hashes': row_hashes, 'column_versions': column_versions, 'anomalies': anomalies,
+            'delta': row_delta(diff, published, df, column_versions), 'diff': diff}
+
+def write_csv(job, df, f, progress=(0.0, 1.0)):
+    """Write a frame as CSV in chunks, reporting progress across a range; stops once cancelled"""
+    low, high = progress
+    for start in range(0, max(len(df), 1), CSV_CHUNK_ROWS):
+        df.iloc[start:start + CSV_CHUNK_ROWS].to_csv(f, index=False, header=start == 0)
+        done = min(start + CSV_CHUNK_ROWS, len(df))
+        job.update(low + (high - low) * done / max(len(df), 1), f"Serialized {done} rows")
+
+def export_csv_task(job, df):
+    """Serialize a frame to CSV bytes in chunks"""
+    buffer = StringIO()
+    write_csv(job, df, buffer)
+    return buffer.getvalue().encode('utf-8')
+
+def cohort_frame(df, positions, pre_col, post_col, columns=None):
+    """A cohort's rows, optionally limited to some columns, with the improvement column added"""
+    frame = df if positions is None else df.iloc[positions]
+    frame = frame[columns] if columns else frame
+    if pre_col and post_col:
+        return frame.assign(Improvement=frame[post_col] - frame[pre_col])
+    return frame.copy()
+
+def export_cohort_task(job, df, positions, pre_col, post_col, columns=None):
+    """Slice a cohort off the active frame and serialize it to CSV bytes"""
+    job.update(0.05, "Slicing cohort")
+    return export_csv_task(job, cohort_frame(df, positions, pre_col, post_col, columns))
+
+def report_bundle_task(job, df, positions, pre_col, post_col, summary_cols, item_statistics, overview):
+    """Zip the analysis, summary, question statistics and overview metrics"""
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        job.update(0.05, "Slicing cohort")
+        frame = cohort_frame(df, positions, pre_col, post_col)
+        with bundle.open('complete_analysis.csv', 'w') as raw, TextIOWrapper(raw, encoding='utf-8', newline='') as f:
+            write_csv(job, frame, f, (0.1, 0.6))
+        if summary_cols:
+            with bundle.open('improvement_summary.csv', 'w') as raw, TextIOWrapper(raw, encoding='utf-8', newline='') as f:
+                write_csv(job, frame[summary_cols + ['Improvement']], f, (0.6, 0.9))
+        for test, stats in item_statistics.items():
+            bundle.writestr(f'question_statistics_{test}.csv', stats.to_csv(index=False))
+        job.update(0.9, "Writing overview metrics")
+        bundle.writestr('overview_metrics.csv', pd.Series(overview, name='Value').to_csv(index_label='Metric'))
+    return buffer.getvalue()
+
+def show_job_status(job):
+    """Render a job's progress with a cancel button, or its failure with a retry button"""
+    if job.active:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.progress(job.progress, text=f"⏳ {job.label}: {job.message or job.status}")
+        with col2:
+            if st.button("✖ Cancel", key=f"cancel_{job.id}"):
+                job.cancel()
+    elif job.status in ('failed', 'cancelled'):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            if job.status == 'failed':
+                st.error(f"❌ {job.label} failed: {job.error}")
+            else:
+                st.warning(f"⚠️ {job.label} was cancelled.")
+        with col2:
+            st.button("🔁 Retry", key=f"retry_{job.id}", on_click=get_job_queue().discard, args=(job.id,))
+
+@st.fragment(run_every=1)
+def poll_job(job_id):
+    """Poll a running job every second and rerun the page once it finishes"""
+    job = get_job_queue().get(job_id)
+    if job is None or not job.active:
+        st.rerun()
+    show_job_status(job)
+
+def show_job_table():
+    """List retained background jobs with their status and progress"""
+    jobs = get_job_queue().jobs()
+    if not jobs:
+        st.caption("No background jobs yet.")
+        return
+    st.dataframe(pd.DataFrame([{
+        'Job ID': job.id,
+        'Task': job.label,
+        'Status': job.status,
+        'Progress': f"{job.progress:.0%}",
+        'Age (s)': int(time.time() - job.created),
+        'Error': job.error or ''
+    } for job in jobs]), hide_index=True, use_container_width=True)
+
+def show_job_download(job, label, file_name, mime):
+    """Download button for a finished job's artifact, or its progress while it runs"""
+    if job.status == 'done':
+        st.download_button(label=label, data=job.result, file_name=file_name, mime=mime,
+                           use_container_width=True, key=f"download_{job.id}", on_click="ignore")
+    elif job.active:
+        poll_job(job.id)
+    else:
+        show_job_status(job)
+
+def show_export(key, button, task, fn, args, label, file_name, mime):
+    """Prepare button for an export; once clicked, the job's progress and then its download button
+
+    Nothing is serialized until someone asks for it, so unused exports never compete with
+    uploads and share jobs for the worker pool.
+    """
+    queue = get_job_queue()
+    job = queue.find(key)
+    if job is None:
+        st.button(button, key=f"prepare_{'_'.join(map(str, key))}", use_container_width=True,
+                  on_click=queue.submit, args=(key, task, fn, *args))
+    else:
+        show_job_download(job, label, file_name, mime)
+
+# ==================== MEMORY MANAGEMENT ====================
+
+MEMORY_BUDGET_MB = int(os.environ.get('DASHBOARD_MEMORY_BUDGET_MB', '1024'))
+SESSION_IDLE_SECONDS = int(os.environ.get('DASHBOARD_SESSION_IDLE_SECONDS', '1800'))
+SESSION_STATE_DEFAULTS = {'uploaded_data': None, 'item_statistics': {}}
+
+def estimate_nbytes(obj, seen=None):
+    """Approximate in-memory size of datasets, arrays, buffers and containers"""
+    seen = set() if seen is None else seen
+    if obj is None or id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(estimate_nbytes(value, seen) for value in obj.values())
+    if isinstance(obj, (list, tuple, set)):
+        return sum(estimate_nbytes(value, seen) for value in obj)
+    return sys.getsizeof(obj)
+
+class MemoryManager:
+    """Process-wide byte accounting with a global budget and cost-aware LRU eviction
+
+    Entries carry an optional release callback; only entries with one can be evicted.
+    Eviction picks the entry with the largest idle-seconds x bytes / cost first, so
+    big, stale, cheap-to-rebuild objects go before small or expensive ones.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def track(self, key, category, obj, release=None, cost=1.0, idle_after=None):
+        """Account obj under key, re-measuring only when the tracked objects change"""
+        signature = tuple(map(id, obj.values())) if isinstance(obj, dict) else id(obj)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['signature'] != signature:
+                entry = {'category': category, 'signature': signature, 'nbytes': estimate_nbytes(obj),
+                         'release': release, 'cost': cost, 'idle_after': idle_after}
+                self._entries[key] = entry
+            entry['last_used'] = time.time()
+        self.enforce(protect=key)
+
+    def touch(self, key):
+        """Mark an entry as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['last_used'] = time.time()
+
+    def forget(self, key):
+        """Stop accounting an entry without releasing it"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def total_bytes(self):
+        return sum(entry['nbytes'] for entry in list(self._entries.values()))
+
+    def usage(self):
+        """Tracked entries and bytes per category"""
+        rows = pd.DataFrame([{'Category': entry['category'], 'Bytes': entry['nbytes']}
+                             for entry in list(self._entries.values())], columns=['Category', 'Bytes'])
+        return rows.groupby('Category')['Bytes'].agg(Entries='count', Bytes='sum').reset_index()
+
+    def enforce(self, protect=None):
+        """Evict releasable entries until usage fits the budget"""
+        now = time.time()
+        with self._lock:
+            excess = sum(entry['nbytes'] for entry in self._entries.values()) - self.budget_bytes
+            if excess <= 0:
+                return
+            candidates = sorted(
+                (key for key, entry in self._entries.items() if key != protect and entry['release']),
+                key=lambda key: (now - self._entries[key]['last_used'] + 1) * self._entries[key]['nbytes']
+                / self._entries[key]['cost'],
+                reverse=True
+            )
+            evicted = []
+            for key in candidates:
+                if excess <= 0:
+                    break
+                excess -= self._entries[key]['nbytes']
+                evicted.append(self._entries.pop(key))
+        self._release(evicted)
+
+    def release_idle(self):
+        """Release entries that have been idle longer than their idle_after"""
+        now = time.time()
+        with self._lock:
+            idle = [key for key, entry in self._entries.items()
+                    if entry['idle_after'] is not None and entry['release']
+                    and now - entry['last_used'] > entry['idle_after']]
+            evicted = [self._entries.pop(key) for key in idle]
+        self._release(evicted)
+        return len(evicted)
+
+    def _release(self, entries):
+        for entry in entries:
+            try:
+                entry['release']()
+            except Exception:
+                pass
+
+@st.cache_resource
+def get_memory_manager():
+    """Process-wide memory manager shared by all sessions and caches"""
+    return MemoryManager(MEMORY_BUDGET_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_dataset_store():
+    """Process-wide published dataset, shared by reference with every session"""
+    return {'version': None, 'data': None, 'item_statistics': {}, 'wave_columns': None, 'sample': None,
+            'row_hashes': None, 'column_versions': None, 'anomalies': None, 'delta': None, 'published': None,
+            'waves_set': None}
+
+def publish_dataset(df, version, item_statistics, sample=None, row_hashes=None, column_versions=None,
+                    anomalies=None, delta=None):
+    """Make a dataset the active one for this session, for new sessions and for other workers"""
+    store = get_dataset_store()
+    republished = store['version'] == version
+    rewaved = store['wave_columns'] != st.session_state.wave_columns
+    store.update(version=version, data=df, item_statistics=item_statistics,
+                 wave_columns=st.session_state.wave_columns, sample=sample,
+                 row_hashes=row_hashes, column_versions=column_versions, anomalies=anomalies,
+                 delta=store['delta'] if republished else delta,
+                 published=store['published'] if republished else time.time(),
+                 waves_set=store['waves_set'] if republished and not rewaved else time.time())
+    get_memory_manager().track(('dataset', 'published'), 'Datasets', df)
+    st.session_state.uploaded_data = df
+    st.session_state.dataset_version = version
+    st.session_state.item_statistics = item_statistics
+    st.session_state.follows_published = True
+    if not republished or rewaved:
+        share_published_dataset(df, version, item_statistics, store['wave_columns'], store['published'],
+                                store['waves_set'])
+
+def adopt_published_dataset():
+    """Point a session at the published dataset, picking up publishes from other workers"""
+    shared = get_shared_core()
+    if shared is not None:
+        load_shared_dataset(shared['manifest'])
+    store = get_dataset_store()
+    if store['data'] is None:
+        return
+    stale = st.session_state.follows_published and st.session_state.dataset_version != store['version']
+    if st.session_state.uploaded_data is None or stale:
+        st.session_state.uploaded_data = store['data']
+        st.session_state.dataset_version = store['version']
+        st.session_state.item_statistics = store['item_statistics']
+        st.session_state.wave_columns = store['wave_columns']
+        st.session_state.follows_published = True
+    elif st.session_state.follows_published and st.session_state.wave_columns != store['wave_columns']:
+        # The admin saved a new wave order for the dataset this session already follows
+        st.session_state.wave_columns = store['wave_columns']
+
+def set_wave_columns(waves):
+    """Configure the wave order for this session and, if it is published, for everyone"""
+    st.session_state.wave_columns = waves
+    store = get_dataset_store()
+    if store['data'] is st.session_state.uploaded_data:
+        store.update(wave_columns=waves, waves_set=time.time())
+        share_published_dataset(store['data'], store['version'], store['item_statistics'], waves,
+                                store['published'], store['waves_set'])
+
+def release_session_state(session_state):
+    """Drop a session's heavy state; it re-adopts the published dataset on its next rerun"""
+    for key, default in SESSION_STATE_DEFAULTS.items():
+        session_state[key] = default
+    session_state['dataset_version'] = None
+
+def track_session():
+    """Account this session's private heavy state and release state of idle sessions"""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    manager = get_memory_manager()
+    store = get_dataset_store()
+    shared = {id(store['data']), id(store['item_statistics'])}
+    private = {key: st.session_state[key] for key in SESSION_STATE_DEFAULTS
+               if id(st.session_state[key]) not in shared}
+    manager.track(('session', ctx.session_id), 'Session state', private,
+                  release=partial(release_session_state, ctx.session_state), idle_after=SESSION_IDLE_SECONDS)
+    manager.release_idle()
+
+def get_media_bytes():
+    """Bytes Streamlit holds for rendered chart images and download payloads"""
+    try:
+        stats = Runtime.instance().stats_mgr.get_stats()
+    except Exception:
+        return None
+    stats = [stat for family in stats.values() for stat in family] if isinstance(stats, dict) else stats
+    return sum(stat.byte_length for stat in stats if 'media_file' in stat.category_name)
+
+@st.fragment
+def show_memory_usage():
+    """Memory usage by category against the global budget"""
+    manager = get_memory_manager()
+    usage = manager.usage()
+    media_bytes = get_media_bytes()
+    if media_bytes is not None:
+        usage = pd.concat([usage, pd.DataFrame([{'Category': 'Chart images & downloads (Streamlit)',
+                                                 'Entries': np.nan, 'Bytes': media_bytes}])],
+                          ignore_index=True)
+    usage['MB'] = usage['Bytes'] / 1024 ** 2
+
+    total_mb = manager.total_bytes() / 1024 ** 2
+    budget_mb = manager.budget_bytes / 1024 ** 2
+    st.progress(min(total_mb / budget_mb, 1.0) if budget_mb else 1.0,
+                text=f"{total_mb:.1f} MB of {budget_mb:.0f} MB budget")
+    st.dataframe(usage[['Category', 'Entries', 'MB']].style.format({'MB': '{:.2f}', 'Entries': '{:.0f}'}),
+                 hide_index=True, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        new_budget = st.number_input("Budget (MB)", min_value=64, value=int(budget_mb), step=64)
+        if new_budget != int(budget_mb):
+            manager.budget_bytes = int(new_budget) * 1024 * 1024
+            manager.enforce()
+    with col2:
+        st.write("")
+        if st.button("🧹 Release idle sessions"):
+            st.info(f"Released {manager.release_idle()} idle session(s).")
+
+# ==================== SHARED SCORE CORE ====================
+
+SHARED_DIR = os.environ.get('DASHBOARD_SHARED_DIR',
+                            os.path.join(tempfile.gettempdir(), f'chatgpt-dashboard-{os.getuid()}'))
+MANIFEST_FILE = 'current.json'
+IMPROVEMENT_CATEGORIES = ['Excellent (≥50%)', 'Strong (20-49%)', 'Moderate (0-19%)', 'Negative (<0%)']
+CORE_DTYPE = np.dtype([('pre', 'f8'), ('post', 'f8'), ('improvement', 'f8'), ('category', 'i1'), ('rank', 'i4')])
+
+def categorize_improvements(improvement):
+    """Vectorized improvement category codes into IMPROVEMENT_CATEGORIES (-1 when missing)"""
+    return np.select([improvement >= 50, improvement >= 20, improvement >= 0, improvement < 0],
+                     [0, 1, 2, 3], default=-1).astype(np.int8)
+
+def build_score_core(df, pre_col, post_col):
+    """Numeric core of a dataset: scores, improvement, category code and class rank per row"""
+    nan = np.full(len(df), np.nan)
+    core = np.zeros(len(df), dtype=CORE_DTYPE)
+    core['pre'] = df[pre_col].to_numpy(dtype=float) if pre_col else nan
+    core['post'] = df[post_col].to_numpy(dtype=float) if post_col else nan
+    core['improvement'] = core['post'] - core['pre']
+    core['category'] = categorize_improvements(core['improvement'])
+    # Rank as on the student page: class size minus the students who improved less
+    ordered = np.sort(core['improvement'][~np.isnan(core['improvement'])])
+    less = np.searchsorted(ordered, core['improvement'], side='left')
+    core['rank'] = len(df) - np.where(np.isnan(core['improvement']), 0, less)
+    return core
+
+def dir_is_private(path, create=False):
+    """Whether path is a real directory owned by this user and closed to everyone else
+
+    Anyone could create a world-writable temp path first and plant files in it, so nothing
+    is written to or read from a directory that fails this check.
+    """
+    if create:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and not info.st_mode & 0o077
+
+def atomic_write(path, write):
+    """Write a file through a temporary sibling so readers never see a partial file"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+def write_shared_dataset_task(job, df, version, item_statistics, wave_columns, published, waves_set,
+                              pre_col, post_col):
+    """Publish the numeric core and the dataset to the private shared directory
+
+    The core is a .npy file and the rows an uncompressed Arrow IPC file, so every worker
+    memory-maps both and nothing executable is ever loaded back.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    if not dir_is_private(SHARED_DIR, create=True):
+        raise RuntimeError(f"{SHARED_DIR} is not a private directory owned by this user; not sharing")
+    stamp = uuid.uuid4().hex[:12]
+    job.update(0.1, "Building score core")
+    core = build_score_core(df, pre_col, post_col)
+    atomic_write(os.path.join(SHARED_DIR, f'core-{stamp}.npy'), lambda f: np.save(f, core))
+    job.update(0.4, "Writing dataset")
+    atomic_write(os.path.join(SHARED_DIR, f'dataset-{version}.arrow'),
+                 lambda f: feather.write_feather(df, pa.PythonFile(f), compression='uncompressed'))
+    items = {test: stats.to_dict(orient='list') for test, stats in item_statistics.items()}
+    atomic_write(os.path.join(SHARED_DIR, f'dataset-{version}.json'), lambda f: f.write(json.dumps(items).encode()))
+    job.update(0.9, "Writing manifest")
+    with np.errstate(invalid='ignore'):
+        summary = {'avg_pre': np.nanmean(core['pre']), 'avg_post': np.nanmean(core['post']),
+                   'avg_improvement': np.nanmean(core['improvement'])}
+    manifest = {
+        'stamp': stamp, 'version': version, 'rows': len(core), 'pre': pre_col, 'post': post_col,
+        'wave_columns': wave_columns, 'published': published, 'waves_set': waves_set,
+        'summary': {key: None if np.isnan(value) else float(value) for key, value in summary.items()},
+        'category_counts': np.bincount(core['category'][core['category'] >= 0], minlength=4).tolist()
+    }
+    atomic_write(os.path.join(SHARED_DIR, MANIFEST_FILE), lambda f: f.write(json.dumps(manifest).encode()))
+
+    # Workers still mapping an older core keep their view until they remap (POSIX unlink semantics)
+    for name in os.listdir(SHARED_DIR):
+        stale_core = name.startswith('core-') and name != f'core-{stamp}.npy'
+        stale_data = name.startswith('dataset-') and not name.startswith(f'dataset-{version}.')
+        if (stale_core or stale_data) and not name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(SHARED_DIR, name))
+            except OSError:
+                pass
+    return manifest
+
+def share_published_dataset(df, version, item_statistics, wave_columns, published, waves_set):
+    """Write the published dataset for other worker processes in the background"""
+    pre_test_cols, post_test_cols = get_test_columns(df, wave_columns)
+    pre_col = pre_test_cols[0] if pre_test_cols else None
+    post_col = post_test_cols[0] if post_test_cols else None
+    # Keyed by publish time too: re-publishing an earlier version must rewrite the manifest again
+    return get_job_queue().submit(('share', version, published, waves_set, pre_col, post_col, repr(wave_columns)),
+                                  "Sharing published dataset", write_shared_dataset_task,
+                                  df, version, item_statistics, wave_columns, published, waves_set, pre_col, post_col)
+
+@st.cache_resource
+def get_core_mapping():
+    """This process's current mapping of the shared score core"""
+    return {'stamp': None, 'mtime': None, 'core': None, 'manifest': None, 'lock': threading.Lock()}
+
+def get_shared_core():
+    """Zero-copy view of the published score core, remapped when a new publish is stamped"""
+    mapping = get_core_mapping()
+    if not dir_is_private(SHARED_DIR):
+        return None
+    try:
+        mtime = os.stat(os.path.join(SHARED_DIR, MANIFEST_FILE)).st_mtime_ns
+    except OSError:
+        return None
+    if mtime != mapping['mtime']:
+        with mapping['lock']:
+            try:
+                with open(os.path.join(SHARED_DIR, MANIFEST_FILE)) as f:
+                    manifest = json.load(f)
+                if manifest['stamp'] != mapping['stamp']:
+                    core = np.load(os.path.join(SHARED_DIR, f"core-{manifest['stamp']}.npy"), mmap_mode='r')
+                    mapping.update(stamp=manifest['stamp'], core=core, manifest=manifest)
+                mapping['mtime'] = mtime
+            except (OSError, ValueError, KeyError):
+                return None
+    return mapping if mapping['core'] is not None else None
+
+def get_core_for(version, pre_col, post_col):
+    """Shared core arrays and manifest if they describe this dataset version and test columns"""
+    shared = get_shared_core()
+    if shared is None:
+        return None, None
+    manifest = shared['manifest']
+    if (manifest['version'], manifest['pre'], manifest['post']) != (version, pre_col, post_col):
+        return None, None
+    return shared['core'], manifest
+
+def core_summary(manifest, key):
+    """A class-level aggregate precomputed at publish time"""
+    value = manifest['summary'][key]
+    return np.nan if value is None else value
+
+def load_shared_dataset(manifest):
+    """Load a dataset published by another worker process into this process's store
+
+    Only a manifest newer than this process's own publish is loaded: right after a local
+    publish the manifest still describes the previous version until the share job writes it.
+    The same goes for a wave order saved for the dataset this process already has.
+    """
+    store = get_dataset_store()
+    if store['version'] == manifest['version']:
+        if (manifest.get('waves_set') or 0) > (store['waves_set'] or 0):
+            store.update(wave_columns=manifest['wave_columns'], waves_set=manifest['waves_set'])
+        return
+    if (store['published'] or 0) >= manifest['published']:
+        return
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    path = os.path.join(SHARED_DIR, f"dataset-{manifest['version']}")
+    try:
+        # Arrow-backed columns stay views of the mapped file, shared through the page cache
+        df = feather.read_table(f"{path}.arrow", memory_map=True).to_pandas(split_blocks=True)
+        with open(f"{path}.json") as f:
+            item_statistics = {test: pd.DataFrame(stats) for test, stats in json.load(f).items()}
+    except (OSError, ValueError, pa.ArrowException):
+        return
+    store.update(version=manifest['version'], data=df, item_statistics=item_statistics,
+                 wave_columns=manifest['wave_columns'], sample=None, row_hashes=None, column_versions=None,
+                 anomalies=None, delta=None, published=manifest['published'], waves_set=manifest.get('waves_set'))
+    get_memory_manager().track(('dataset', 'published'), 'Datasets', df)
+
+# ==================== METRICS API ====================
+
+# Loopback by default: the endpoints serve student emails and names
+API_HOST = os.environ.get('DASHBOARD_API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('DASHBOARD_API_PORT', '8502'))
+API_TOKEN = os.environ.get('DASHBOARD_API_TOKEN')
+API_DEFAULT_LIMIT = 1000
+API_MAX_LIMIT = 10000
+API_CACHE_ENTRIES = 256
+ARROW_MIME = 'application/vnd.apache.arrow.stream'
+
+def api_summary(core, manifest, frame):
+    """Class aggregates for the published dataset"""
+    improvement = core['improvement']
+    return {
+        'students': manifest['rows'],
+        'avg_pre': core_summary(manifest, 'avg_pre'),
+        'avg_post': core_summary(manifest, 'avg_post'),
+        'avg_improvement': core_summary(manifest, 'avg_improvement'),
+        'improved': int((improvement > 0).sum()),
+        'neutral': int((improvement == 0).sum()),
+        'declined': int((improvement < 0).sum()),
+        'pre_column': manifest['pre'],
+        'post_column': manifest['post']
+    }
+
+def api_categories(core, manifest, frame):
+    """Student counts per improvement category"""
+    return dict(zip(IMPROVEMENT_CATEGORIES, manifest['category_counts']))
+
+def api_schema(core, manifest, frame):
+    """Schema profile of the published dataset"""
+    return profile_schema(frame)
+
+def api_students(core, manifest, frame, offset, limit):
+    """One page of per-student results"""
+    rows = slice(offset, offset + limit)
+    email_col, name_col = detect_email_column(frame), detect_name_column(frame)
+    labels = np.array(IMPROVEMENT_CATEGORIES + [None], dtype=object)
+    return pd.DataFrame({
+        'email': frame[email_col].iloc[rows].to_numpy() if email_col else None,
+        'name': frame[name_col].iloc[rows].to_numpy() if name_col else None,
+        'pre': core['pre'][rows],
+        'post': core['post'][rows],
+        'improvement': core['improvement'][rows],
+        'category': labels[core['category'][rows]],
+        'rank': core['rank'][rows]
+    })
+
+API_ROUTES = {
+    '/api/v1/summary': api_summary,
+    '/api/v1/categories': api_categories,
+    '/api/v1/schema': api_schema,
+    '/api/v1/students': api_students
+}
+
+def encode_api_payload(payload, fmt, meta):
+    """Serialize a dict or frame as compact JSON, or a frame as an Arrow IPC stream"""
+    if isinstance(payload, pd.DataFrame):
+        if fmt == 'arrow':
+            import pyarrow as pa
+            table = pa.Table.from_pandas(payload, preserve_index=False).replace_schema_metadata(
+                {key: str(value) for key, value in meta.items()})
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return sink.getvalue().to_pybytes(), ARROW_MIME
+        payload = {**meta, **json.loads(payload.to_json(orient='split', index=False))}
+    else:
+        payload = {**meta, 'data': {key: None if isinstance(value, float) and np.isnan(value) else value
+                                    for key, value in payload.items()}}
+    body = json.dumps(payload, separators=(',', ':'), default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+    return body.encode('utf-8'), 'application/json'
+
+@st.cache_resource
+def get_api_cache():
+    """Encoded responses for the current publish stamp"""
+    return {'stamp': None, 'responses': {}, 'lock': threading.Lock()}
+
+def build_api_response(path, params, fmt):
+    """Status, ETag, body and content type for a metrics API request"""
+    shared = get_shared_core()
+    if shared is None:
+        return 503, None, b'{"error":"no dataset published"}', 'application/json'
+    core, manifest = shared['core'], shared['manifest']
+    etag = f'"{manifest["stamp"]}"'
+
+    handler = API_ROUTES[path]
+    offset = limit = None
+    if handler is api_students:
+        try:
+            offset = max(int(params.get('offset', ['0'])[0]), 0)
+            limit = min(max(int(params.get('limit', [str(API_DEFAULT_LIMIT)])[0]), 1), API_MAX_LIMIT)
+        except ValueError:
+            return 400, None, b'{"error":"offset and limit must be integers"}', 'application/json'
+
+    cache = get_api_cache()
+    key = (path, offset, limit, fmt)
+    with cache['lock']:
+        if cache['stamp'] != manifest['stamp']:
+            cache.update(stamp=manifest['stamp'], responses={})
+        cached = cache['responses'].get(key)
+    if cached is not None:
+        return 200, etag, *cached
+
+    load_shared_dataset(manifest)
+    store = get_dataset_store()
+    frame = store['data']
+    # Rows and core must come from the same publish; the manifest lags a local publish until
+    # its share job finishes, and emails paired with another version's scores would be wrong
+    if frame is None or store['version'] != manifest['version'] or store['data'] is not frame:
+        return 503, None, b'{"error":"published dataset not available on this host yet"}', 'application/json'
+    meta = {'version': manifest['version'], 'published': manifest['published']}
+    if handler is api_students:
+        payload = handler(core, manifest, frame, offset, limit)
+        meta.update(total=manifest['rows'], offset=offset, limit=limit)
+    else:
+        payload = handler(core, manifest, frame)
+    if fmt == 'arrow' and not isinstance(payload, pd.DataFrame):
+        fmt = 'json'
+    body, content_type = encode_api_payload(payload, fmt, meta)
+
+    with cache['lock']:
+        if cache['stamp'] == manifest['stamp'] and len(cache['responses']) < API_CACHE_ENTRIES:
+            cache['responses'][key] = (body, content_type)
+    return 200, etag, body, content_type
+
+class MetricsAPIHandler(BaseHTTPRequestHandler):
+    """Read-only HTTP endpoints over the published dataset with ETag revalidation"""
+
+    server_version = 'ChatGPTDashboardAPI/1.0'
+
+    def do_GET(self):
+        authorization = self.headers.get('Authorization', '').encode('utf-8')
+        if not hmac.compare_digest(authorization, f'Bearer {API_TOKEN}'.encode('utf-8')):
+            return self._send(401, b'{"error":"unauthorized"}', 'application/json')
+        url = urlparse(self.path)
+        if url.path not in API_ROUTES:
+            return self._send(404, b'{"error":"not found"}', 'application/json')
+
+        # Revalidate against the publish stamp before loading or encoding anything
+        shared = get_shared_core()
+        if shared is not None:
+            etag = f'"{shared["manifest"]["stamp"]}"'
+            if etag in self.headers.get('If-None-Match', ''):
+                return self._send(304, b'', None, etag)
+
+        params = parse_qs(url.query)
+        wants_arrow = params.get('format') == ['arrow'] or ARROW_MIME in self.headers.get('Accept', '')
+        try:
+            status, etag, body, content_type = build_api_response(url.path, params, 'arrow' if wants_arrow else 'json')
+        except Exception as e:
+            return self._send(500, json.dumps({'error': str(e)}).encode('utf-8'), 'application/json')
+        self._send(status, body, content_type, etag)
+
+    def _send(self, status, body, content_type, etag=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@st.cache_resource
+def start_metrics_api():
+    """Serve the metrics API from a daemon thread; the first worker on the host gets the port"""
+    if not API_TOKEN:
+        return None
+    try:
+        server = ThreadingHTTPServer((API_HOST, API_PORT), MetricsAPIHandler)
+    except OSError:
+        return None
+    threading.Thread(target=server.serve_forever, name='metrics-api', daemon=True).start()
+    return server
+
+def show_api_status():
+    """Metrics API endpoints and whether this worker is serving them"""
+    if not API_TOKEN:
+        st.info("The metrics API is disabled. Set DASHBOARD_API_TOKEN to enable it.")
+        return
+    server = start_metrics_api()
+    if server is not None:
+        st.success(f"✅ Serving on {API_HOST}:{API_PORT}")
+    else:
+        st.info(f"Port {API_PORT} is served by another worker process on this host.")
+    st.markdown("""
+    <div class="info-box">
+    <strong>📌 Endpoints</strong> (send <code>Authorization: Bearer &lt;token&gt;</code>):
+    <code>/api/v1/summary</code>, <code>/api/v1/categories</code>, <code>/api/v1/schema</code>,
+    <code>/api/v1/students?offset=0&amp;limit=1000</code> (add <code>format=arrow</code> for Arrow).
+    Responses carry an ETag that changes with each publish; send it back in <code>If-None-Match</code>
+    to get a 304 when nothing changed.
+    </div>
+    """, unsafe_allow_html=True)
+
+# ==================== REQUEST PROFILER ====================
+
+PROFILE_DIR = os.environ.get('DASHBOARD_PROFILE_DIR',
+                             os.path.join(tempfile.gettempdir(), f'chatgpt-dashboard-profiles-{os.getuid()}'))
+PROFILE_MODES = {'Sampling': 'collapsed.txt', 'Deterministic': 'prof'}
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_TOP_FUNCTIONS = 20
+MAX_PROFILES = 50
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts
+
+    Mirrors the enable/disable/dump_stats surface of ``cProfile.Profile`` so either can
+    drive a capture.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._thread = threading.Thread(target=self._sample, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if frames:
+                stack = ';'.join(reversed(frames))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def dump_stats(self, path):
+        """Write Brendan Gregg collapsed stacks, which speedscope and flamegraph.pl read directly"""
+        lines = ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+        atomic_write(path, lambda f: f.write(lines.encode('utf-8')))
+
+def frame_label(code):
+    """Frame name used in collapsed stacks and hot-function tables"""
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def hot_functions(profiler):
+    """Top functions by self time from a stack sampler or a cProfile profiler"""
+    if isinstance(profiler, StackSampler):
+        self_counts, total_counts = {}, {}
+        for stack, count in profiler.stacks.items():
+            frames = stack.split(';')
+            self_counts[frames[-1]] = self_counts.get(frames[-1], 0) + count
+            for frame in set(frames):
+                total_counts[frame] = total_counts.get(frame, 0) + count
+        hot = pd.DataFrame({'Calls': np.nan,
+                            'Self (s)': pd.Series(self_counts, dtype=float) * profiler.interval,
+                            'Total (s)': pd.Series(total_counts, dtype=float) * profiler.interval})
+        hot = hot.fillna({'Self (s)': 0.0}).rename_axis('Function').reset_index()
+    else:
+        stats = pstats.Stats(profiler).stats
+        hot = pd.DataFrame([
+            {'Function': f"{name} ({os.path.basename(file)}:{line})", 'Calls': calls,
+             'Self (s)': self_time, 'Total (s)': total_time}
+            for (file, line, name), (_, calls, self_time, total_time, _) in stats.items()
+        ], columns=['Function', 'Calls', 'Self (s)', 'Total (s)'])
+    return hot.sort_values('Self (s)', ascending=False).head(PROFILE_TOP_FUNCTIONS).reset_index(drop=True)
+
+@st.cache_resource
+def get_profiler_state():
+    """Process-wide profiler arming state and the captures taken so far"""
+    return {'role': None, 'remaining': 0, 'mode': 'Sampling', 'captures': [], 'lock': threading.Lock()}
+
+def arm_profiler(role, reruns, mode):
+    """Profile the next reruns of a role's page in this process (reruns=0 disarms)"""
+    state = get_profiler_state()
+    with state['lock']:
+        state.update(role=role, remaining=reruns, mode=mode)
+
+def claim_profile_run(role):
+    """Claim one armed capture for this rerun, or None after a lock-free check when disarmed"""
+    state = get_profiler_state()
+    if state['remaining'] <= 0 or state['role'] != role:
+        return None
+    with state['lock']:
+        if state['remaining'] <= 0 or state['role'] != role:
+            return None
+        state['remaining'] -= 1
+        return state['mode']
+
+def run_profiled(page, role, mode):
+    """Run one rerun of a page under the chosen profiler and record the capture"""
+    if mode == 'Deterministic':
+        profiler = cProfile.Profile()
+    else:
+        profiler = StackSampler(threading.get_ident())
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one cProfile per process; run unprofiled rather than fail the page
+        return page()
+    started = time.perf_counter()
+    try:
+        page()
+    finally:
+        # st.rerun() and st.stop() unwind as BaseException; the capture is still recorded
+        elapsed = time.perf_counter() - started
+        profiler.disable()
+        record_profile(profiler, role, mode, elapsed)
+
+def record_profile(profiler, role, mode, elapsed):
+    """Write a capture to PROFILE_DIR and keep its hot functions for the admin dashboard
+
+    Captures hold source paths and timings, so no file is written unless PROFILE_DIR is private.
+    """
+    path = ''
+    if dir_is_private(PROFILE_DIR, create=True):
+        name = f"{role.lower()}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.{PROFILE_MODES[mode]}"
+        path = os.path.join(PROFILE_DIR, name)
+        profiler.dump_stats(path)
+    state = get_profiler_state()
+    with state['lock']:
+        state['captures'].append({'Captured': time.strftime('%H:%M:%S'), 'Role': role, 'Mode': mode,
+                                  'Seconds': elapsed, 'File': path, 'hot': hot_functions(profiler)})
+        stale, state['captures'] = state['captures'][:-MAX_PROFILES], state['captures'][-MAX_PROFILES:]
+    for capture in stale:
+        try:
+            if capture['File']:
+                os.remove(capture['File'])
+        except OSError:
+            pass
+
+@st.fragment
+def show_profiler_controls():
+    """Arm captures for a role's page and browse hot functions of recent captures"""
+    state = get_profiler_state()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        role = st.selectbox("Page", ['Teacher', 'Student', 'Admin'], key="profile_role")
+    with col2:
+        reruns = st.number_input("Reruns to capture", min_value=1, max_value=50, value=5, key="profile_reruns")
+    with col3:
+        mode = st.radio("Profiler", list(PROFILE_MODES), key="profile_mode", horizontal=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("▶️ Profile next reruns"):
+            arm_profiler(role, int(reruns), mode)
+    with col2:
+        if st.button("⏹️ Disarm"):
+            arm_profiler(None, 0, mode)
+    if state['remaining'] > 0:
+        st.info(f"🔬 Profiling the next {state['remaining']} {state['role']} rerun(s) in this worker "
+                f"({state['mode'].lower()}).")
+
+    captures = state['captures'][::-1]
+    if not captures:
+        st.caption(f"No captures yet. Profiles are written to {PROFILE_DIR}.")
+        return
+    table = pd.DataFrame(captures).drop(columns='hot')
+    table['File'] = table['File'].map(os.path.basename)
+    st.dataframe(table.style.format({'Seconds': '{:.3f}'}), hide_index=True, use_container_width=True)
+
+    choice = st.selectbox("Capture", range(len(captures)), key="profile_capture",
+                          format_func=lambda i: f"{captures[i]['Captured']} · {captures[i]['Role']} · "
+                                                f"{captures[i]['Seconds']:.3f}s")
+    capture = captures[choice]
+    st.dataframe(capture['hot'].style.format({'Calls': '{:.0f}', 'Self (s)': '{:.3f}', 'Total (s)': '{:.3f}'}),
+                 hide_index=True, use_container_width=True)
+    if not capture['File']:
+        st.caption(f"{PROFILE_DIR} is not a private directory owned by this user, so this capture "
+                   "was kept in memory only.")
+        return
+    try:
+        with open(capture['File'], 'rb') as f:
+            st.download_button("📥 Download Profile", f.read(), os.path.basename(capture['File']),
+                               key="profile_download", on_click="ignore")
+    except OSError:
+        st.caption("The profile file is no longer on disk.")
+    st.caption("Collapsed-stack files open directly in speedscope or flamegraph.pl; "
+               ".prof files load with pstats or snakeviz.")
+
 # ==================== AUTHENTICATION FUNCTIONS ====================
 
 def initialize_session():
@@ -229,6 +2517,19 @@ def initialize_session():
         st.session_state.user_name = None
     if 'uploaded_data' not in st.session_state:
         st.session_state.uploaded_data = None
+    if 'answer_keys' not in st.session_state:
+        st.session_state.answer_keys = {}
+    if 'item_statistics' not in st.session_state:
+        st.session_state.item_statistics = {}
+    if 'dataset_version' not in st.session_state:
+        st.session_state.dataset_version = None
+    if 'published_job' not in st.session_state:
+        st.session_state.published_job = None
+    if 'wave_columns' not in st.session_state:
+        st.session_state.wave_columns = None
+    if 'follows_published' not in st.session_state:
+        st.session_state.follows_published = False
+    adopt_published_dataset()
 
 def authenticate_user(email, password):
     """Authenticate user based on role"""
@@ -249,7 +2550,7 @@ def authenticate_user(email, password):
         email_col = detect_email_column(df)
         
         if email_col:
-            student_row = df[df[email_col].str.lower().str.strip() == email]
+            student_row = find_student_rows(df, email)
             
             if not student_row.empty:
                 expected_password = extract_email_prefix(email)
@@ -261,12 +2562,11 @@ def authenticate_user(email, password):
     return False, None, None
 
 def logout():
-    """Logout user and clear session"""
+    """Logout user and clear session (a button callback, so the next run renders the login page)"""
     st.session_state.authenticated = False
     st.session_state.user_email = None
     st.session_state.user_role = None
     st.session_state.user_name = None
-    st.rerun()
 
 # ==================== LOGIN PAGE ====================
 
@@ -343,25 +2643,50 @@ def show_admin_dashboard():
     
     col1, col2 = st.columns([3, 1])
     with col2:
-        if st.button("🚪 Logout"):
-            logout()
+        st.button("🚪 Logout", on_click=logout)
     
     st.markdown("### 📤 Upload Dataset")
     st.markdown('<div class="info-box">Upload CSV file exported from Google Forms. The system will automatically detect columns.</div>', unsafe_allow_html=True)
     
     uploaded_file = st.file_uploader("Choose CSV file", type=['csv'], key="admin_upload")
     
+    upload_job = None
     if uploaded_file is not None:
+        answer_keys = st.session_state.answer_keys
+        upload_job = get_job_queue().submit(
+            ('upload', uploaded_file.file_id, repr(answer_keys)), "Processing upload",
+            process_upload_task, uploaded_file.getvalue(), answer_keys, dict(get_dataset_store())
+        )
+        if upload_job.active:
+            poll_job(upload_job.id)
+        elif upload_job.status != 'done':
+            show_job_status(upload_job)
+
+    if upload_job is not None and upload_job.status == 'done':
         try:
-            df = pd.read_csv(uploaded_file)
-            df = clean_column_names(df)
+            if st.session_state.published_job != upload_job.id:
+                result = upload_job.result
+                publish_dataset(result['data'], result['version'], result['item_statistics'], result['sample'],
+                                result['row_hashes'], result['column_versions'], result['anomalies'],
+                                result['delta'])
+                st.session_state.published_job = upload_job.id
+                # The published store now owns the frame; keep only the job's metadata
+                upload_job.result = {'version': result['version'], 'diff': result['diff']}
+                get_memory_manager().forget(('job', upload_job.id))
+            df = st.session_state.uploaded_data
             
             st.success(f"✅ File uploaded successfully! {len(df)} records found.")
-            
-            st.session_state.uploaded_data = df
-            
+            show_upload_diff(upload_job.result.get('diff'), df)
+
+            show_answer_key_editor(df)
+            show_wave_editor(df)
+
+            if st.session_state.item_statistics:
+                st.markdown("### 🧮 Question Statistics")
+                show_item_statistics(st.session_state.item_statistics)
+
             st.markdown("### 📊 Dataset Preview")
-            st.dataframe(df.head(10), use_container_width=True)
+            show_dataset_browser(df, st.session_state.dataset_version, key="admin_browser")
             
             st.markdown("### 📈 Dataset Statistics")
             col1, col2, col3, col4 = st.columns(4)
@@ -379,31 +2704,28 @@ def show_admin_dashboard():
                 st.metric("Missing Data %", f"{missing_pct:.1f}%")
             
             st.markdown("### 🔍 Detected Columns")
-            cols_info = []
-            for col in df.columns:
-                dtype = str(df[col].dtype)
-                null_count = df[col].isnull().sum()
-                cols_info.append({
-                    'Column': col,
-                    'Type': dtype,
-                    'Missing': null_count,
-                    'Unique': df[col].nunique()
-                })
-            
-            st.dataframe(pd.DataFrame(cols_info), use_container_width=True)
+            st.dataframe(profile_schema(df), use_container_width=True)
             
             # Download processed data
-            csv = df.to_csv(index=False)
-            st.download_button(
-                label="📥 Download Processed Data",
-                data=csv,
-                file_name="processed_data.csv",
-                mime="text/csv"
-            )
+            show_export(('export', st.session_state.dataset_version), "⚙️ Prepare Processed Data",
+                        "Preparing processed data", export_csv_task, (df,),
+                        "📥 Download Processed Data", "processed_data.csv", "text/csv")
             
         except Exception as e:
             st.error(f"❌ Error processing file: {str(e)}")
     
+    with st.expander("⚙️ Background Jobs"):
+        show_job_table()
+    
+    with st.expander("🧠 Memory Usage"):
+        show_memory_usage()
+    
+    with st.expander("🔌 Metrics API"):
+        show_api_status()
+    
+    with st.expander("🔬 Request Profiler"):
+        show_profiler_controls()
+    
     # Show current dataset status
     if st.session_state.uploaded_data is not None:
         st.markdown("---")
@@ -426,22 +2748,43 @@ def show_teacher_dashboard():
     
     col1, col2 = st.columns([3, 1])
     with col2:
-        if st.button("🚪 Logout"):
-            logout()
+        st.button("🚪 Logout", on_click=logout)
     
     if st.session_state.uploaded_data is None:
         st.warning("⚠️ No data available. Please contact admin to upload dataset.")
         return
     
-    df = st.session_state.uploaded_data.copy()
+    base_df = st.session_state.uploaded_data
     
     # Detect key columns
-    email_col = detect_email_column(df)
-    name_col = detect_name_column(df)
+    email_col = detect_email_column(base_df)
+    name_col = detect_name_column(base_df)
     
     # Try to find Pre-Test and Post-Test columns
-    pre_test_cols = [col for col in df.columns if 'pre' in col.lower() and 'score' in col.lower()]
-    post_test_cols = [col for col in df.columns if 'post' in col.lower() and 'score' in col.lower()]
+    pre_test_cols, post_test_cols = get_test_columns(base_df, st.session_state.wave_columns)
+    pre_col = pre_test_cols[0] if pre_test_cols else None
+    post_col = post_test_cols[0] if post_test_cols else None
+    
+    # ==================== COHORT FILTERS ====================
+    group_cols = get_group_columns(base_df, get_dataset_version())
+    cohort_key = columns_version(get_column_versions(base_df, get_dataset_version()), [pre_col, post_col, *group_cols])
+    cohort_index = get_cohort_index(base_df, cohort_key, pre_col, post_col, group_cols)
+    positions, cohort_stats = show_cohort_filters(cohort_index)
+    overview = summarize_cohort(cohort_stats)
+    cohort, intervals = overview, {}
+    approximate = show_approximate_toggle(len(base_df))
+    if approximate:
+        sample = get_stratified_sample(base_df, get_dataset_version())
+        rows, weights = sample_cohort(sample, positions)
+        df = base_df.iloc[rows].copy()
+        cohort, intervals = estimate_cohort(df, weights, pre_col, post_col, overview['students'])
+        st.caption(f"⚡ Estimated from {len(rows):,} of {overview['students']:,} students, sampled within each "
+                   f"{sample['strata_col'] or 'dataset'} stratum. ± values are 95% confidence intervals.")
+    else:
+        df = base_df.copy() if positions is None else base_df.iloc[positions].copy()
+    cohort_digest = 'all' if positions is None else hashlib.sha1(positions.tobytes()).hexdigest()
+    # Charts depend only on the dataset, cohort, test columns and mode; reruns of the same view reuse them
+    view_key = (get_dataset_version(), cohort_digest, pre_col, post_col, approximate)
     
     # ==================== OVERVIEW METRICS ====================
     st.markdown("## 📊 Overview Metrics")
@@ -449,43 +2792,46 @@ def show_teacher_dashboard():
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        st.markdown("""
+        st.markdown(f"""
             <div class="metric-card">
                 <h3>Total Students</h3>
-                <h1>123</h1>
+                <h1>{cohort['students']}</h1>
             </div>
             """, unsafe_allow_html=True)
 
     
     with col2:
      if pre_test_cols:
-        avg_pre = df[pre_test_cols[0]].mean()
+        avg_pre = cohort['avg_pre']
         st.markdown(f"""
             <div class="metric-card">
                 <h4>📝 Avg Pre-Test</h4>
                 <h1>{avg_pre:.1f}%</h1>
+                {format_interval(intervals.get('avg_pre'))}
             </div>
         """, unsafe_allow_html=True)
 
     
     with col3:
      if post_test_cols:
-        avg_post = df[post_test_cols[0]].mean()
+        avg_post = cohort['avg_post']
         st.markdown(f"""
             <div class="metric-card">
                 <h4>✅ Avg Post-Test</h4>
                 <h1>{avg_post:.1f}%</h1>
+                {format_interval(intervals.get('avg_post'))}
             </div>
         """, unsafe_allow_html=True)
 
     
     with col4:
      if pre_test_cols and post_test_cols:
-        avg_improvement = df[post_test_cols[0]].mean() - df[pre_test_cols[0]].mean()
+        avg_improvement = cohort['avg_improvement']
         st.markdown(f"""
             <div class="metric-card">
                 <h4>📈 Avg Improvement</h4>
                 <h1>{avg_improvement:+.1f}%</h1>
+                {format_interval(intervals.get('avg_improvement'))}
             </div>
         """, unsafe_allow_html=True)
 
@@ -500,25 +2846,36 @@ def show_teacher_dashboard():
         
         with col1:
             st.markdown("### 📊 Score Distribution Comparison")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            
-            x = np.arange(len(df))
-            width = 0.35
-            
-            pre_scores = df[pre_test_cols[0]].fillna(0)
-            post_scores = df[post_test_cols[0]].fillna(0)
-            
-            ax.bar(x - width/2, pre_scores, width, label='Pre-Test', color='#ef4444', alpha=0.8)
-            ax.bar(x + width/2, post_scores, width, label='Post-Test', color='#10b981', alpha=0.8)
-            
-            ax.set_xlabel('Student Index', fontsize=12, fontweight='bold')
-            ax.set_ylabel('Score (%)', fontsize=12, fontweight='bold')
-            ax.set_title('Pre-Test vs Post-Test Scores', fontsize=14, fontweight='bold', pad=20)
-            ax.legend()
-            ax.grid(axis='y', alpha=0.3)
-            
-            st.pyplot(fig)
-            plt.close()
+            def draw_scores():
+                fig, ax = plt.subplots(figsize=(10, 6))
+                if approximate:
+                    # Per-student bars do not scale; show the weighted score distributions instead
+                    sampled = {col: df[col].to_numpy(dtype=float) for col in (pre_col, post_col)}
+                    bins = np.histogram_bin_edges(np.concatenate([v[~np.isnan(v)] for v in sampled.values()]), bins=20)
+                    for col, label, color in ((pre_col, 'Pre-Test', '#ef4444'), (post_col, 'Post-Test', '#10b981')):
+                        valid = ~np.isnan(sampled[col])
+                        ax.hist(sampled[col][valid], bins=bins, weights=weights[valid], label=label, color=color, alpha=0.6)
+                    ax.set_xlabel('Score (%)', fontsize=12, fontweight='bold')
+                    ax.set_ylabel('Estimated Students', fontsize=12, fontweight='bold')
+                    ax.set_title('Pre-Test vs Post-Test Score Distribution (estimated)', fontsize=14, fontweight='bold', pad=20)
+                else:
+                    x = np.arange(len(df))
+                    width = 0.35
+                    # Missing scores stay NaN (no bar) rather than plotting as zeros; they are flagged below
+                    pre_scores = df[pre_test_cols[0]]
+                    post_scores = df[post_test_cols[0]]
+
+                    ax.bar(x - width/2, pre_scores, width, label='Pre-Test', color='#ef4444', alpha=0.8)
+                    ax.bar(x + width/2, post_scores, width, label='Post-Test', color='#10b981', alpha=0.8)
+
+                    ax.set_xlabel('Student Index', fontsize=12, fontweight='bold')
+                    ax.set_ylabel('Score (%)', fontsize=12, fontweight='bold')
+                    ax.set_title('Pre-Test vs Post-Test Scores', fontsize=14, fontweight='bold', pad=20)
+                ax.legend()
+                ax.grid(axis='y', alpha=0.3)
+                return fig
+
+            show_chart((*view_key, 'scores'), draw_scores)
             
             st.markdown("""
             <div class="info-box">
@@ -529,28 +2886,30 @@ def show_teacher_dashboard():
         
         with col2:
             st.markdown("### 📊 Average Score Comparison")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            
             categories = ['Pre-Test', 'Post-Test']
-            scores = [df[pre_test_cols[0]].mean(), df[post_test_cols[0]].mean()]
+            scores = [cohort['avg_pre'], cohort['avg_post']]
             colors = ['#ef4444', '#10b981']
+
+            def draw_averages():
+                fig, ax = plt.subplots(figsize=(10, 6))
+                errors = [intervals['avg_pre'], intervals['avg_post']] if approximate else None
+                bars = ax.bar(categories, scores, color=colors, alpha=0.8, edgecolor='black', linewidth=2,
+                              yerr=errors, capsize=10)
             
-            bars = ax.bar(categories, scores, color=colors, alpha=0.8, edgecolor='black', linewidth=2)
-            
-            # Add value labels on bars
-            for bar in bars:
-                height = bar.get_height()
-                ax.text(bar.get_x() + bar.get_width()/2., height,
-                       f'{height:.1f}%',
-                       ha='center', va='bottom', fontsize=14, fontweight='bold')
-            
-            ax.set_ylabel('Average Score (%)', fontsize=12, fontweight='bold')
-            ax.set_title('Class Average Performance', fontsize=14, fontweight='bold', pad=20)
-            ax.set_ylim(0, 110)
-            ax.grid(axis='y', alpha=0.3)
+                # Add value labels on bars
+                for bar in bars:
+                    height = bar.get_height()
+                    ax.text(bar.get_x() + bar.get_width()/2., height,
+                           f'{height:.1f}%',
+                           ha='center', va='bottom', fontsize=14, fontweight='bold')
             
-            st.pyplot(fig)
-            plt.close()
+                ax.set_ylabel('Average Score (%)', fontsize=12, fontweight='bold')
+                ax.set_title('Class Average Performance', fontsize=14, fontweight='bold', pad=20)
+                ax.set_ylim(0, 110)
+                ax.grid(axis='y', alpha=0.3)
+                return fig
+
+            show_chart((*view_key, 'averages'), draw_averages)
             
             improvement_pct = ((scores[1] - scores[0]) / scores[0] * 100) if scores[0] > 0 else 0
             st.markdown(f"""
@@ -568,43 +2927,54 @@ def show_teacher_dashboard():
         col1, col2 = st.columns(2)
         
         with col1:
-            fig, ax = plt.subplots(figsize=(10, 6))
-            
-            colors_improvement = ['#10b981' if x >= 0 else '#ef4444' for x in df['Improvement']]
-            ax.barh(range(len(df)), df['Improvement'], color=colors_improvement, alpha=0.8)
-            
-            ax.set_xlabel('Improvement (Post - Pre) %', fontsize=12, fontweight='bold')
-            ax.set_ylabel('Student Index', fontsize=12, fontweight='bold')
-            ax.set_title('Individual Student Improvement', fontsize=14, fontweight='bold', pad=20)
-            ax.axvline(x=0, color='black', linestyle='--', linewidth=1)
-            ax.grid(axis='x', alpha=0.3)
-            
-            st.pyplot(fig)
-            plt.close()
+            def draw_improvement():
+                fig, ax = plt.subplots(figsize=(10, 6))
+                if approximate:
+                    improvement = df['Improvement'].to_numpy(dtype=float)
+                    valid = ~np.isnan(improvement)
+                    ax.hist(improvement[valid], bins=30, weights=weights[valid], color='#3b82f6', alpha=0.8)
+                    ax.set_xlabel('Improvement (Post - Pre) %', fontsize=12, fontweight='bold')
+                    ax.set_ylabel('Estimated Students', fontsize=12, fontweight='bold')
+                    ax.set_title('Improvement Distribution (estimated)', fontsize=14, fontweight='bold', pad=20)
+                else:
+                    colors_improvement = ['#10b981' if x >= 0 else '#ef4444' for x in df['Improvement']]
+                    ax.barh(range(len(df)), df['Improvement'], color=colors_improvement, alpha=0.8)
+                    ax.set_xlabel('Improvement (Post - Pre) %', fontsize=12, fontweight='bold')
+                    ax.set_ylabel('Student Index', fontsize=12, fontweight='bold')
+                    ax.set_title('Individual Student Improvement', fontsize=14, fontweight='bold', pad=20)
+                ax.axvline(x=0, color='black', linestyle='--', linewidth=1)
+                ax.grid(axis='x', alpha=0.3)
+                return fig
+
+            show_chart((*view_key, 'improvement'), draw_improvement)
         
         with col2:
-            fig, ax = plt.subplots(figsize=(10, 6))
-            
-            improvement_categories = []
-            for imp in df['Improvement']:
-                if imp >= 50:
-                    improvement_categories.append('Excellent (≥50%)')
-                elif imp >= 20:
-                    improvement_categories.append('Strong (20-49%)')
-                elif imp >= 0:
-                    improvement_categories.append('Moderate (0-19%)')
+            labels = np.array(IMPROVEMENT_CATEGORIES)
+            if approximate:
+                category_counts, half_widths = estimate_category_shares(df['Improvement'].to_numpy(dtype=float), weights)
+                labels = np.array([f"{label}\n(± {100 * h:.1f}%)" for label, h in zip(labels, half_widths)])
+            else:
+                core, _ = get_core_for(get_dataset_version(), pre_col, post_col)
+                if core is not None:
+                    category_codes = core['category'] if positions is None else core['category'][positions]
                 else:
-                    improvement_categories.append('Negative (<0%)')
-            
-            category_counts = pd.Series(improvement_categories).value_counts()
+                    category_codes = categorize_improvements(df['Improvement'].to_numpy())
+                category_counts = np.bincount(category_codes[category_codes >= 0], minlength=len(IMPROVEMENT_CATEGORIES))
+            shown = category_counts > 0
             
-            colors_pie = ['#10b981', '#3b82f6', '#f59e0b', '#ef4444']
-            ax.pie(category_counts.values, labels=category_counts.index, autopct='%1.1f%%',
-                   colors=colors_pie, startangle=90)
-            ax.set_title('Improvement Categories', fontsize=14, fontweight='bold', pad=20)
-            
-            st.pyplot(fig)
-            plt.close()
+            if category_counts.any():
+                def draw_categories():
+                    fig, ax = plt.subplots(figsize=(10, 6))
+                    colors_pie = np.array(['#10b981', '#3b82f6', '#f59e0b', '#ef4444'])
+                    ax.pie(category_counts[shown], labels=labels[shown], autopct='%1.1f%%',
+                           colors=colors_pie[shown], startangle=90)
+                    ax.set_title('Improvement Categories' + (' (estimated)' if approximate else ''),
+                                 fontsize=14, fontweight='bold', pad=20)
+                    return fig
+
+                show_chart((*view_key, 'categories'), draw_categories)
+            else:
+                st.info("No student in this cohort has both a pre-test and a post-test score.")
         
         # Statistical Analysis
         st.markdown("---")
@@ -613,34 +2983,59 @@ def show_teacher_dashboard():
         col1, col2, col3 = st.columns(3)
         
     with col1:
-        improved = (df['Improvement'] > 0).sum()
+        improved = cohort['improved']
         st.markdown(f"""
             <div class="metric-card">
                 <h4>✅ Students Improved</h4>
                 <h1>{improved}</h1>
+                {format_interval(intervals.get('improved'), '{:,.0f}')}
             </div>
     """, unsafe_allow_html=True)
 
         
         with col2:
-            neutral = (df['Improvement'] == 0).sum()
+            neutral = cohort['neutral']
             st.markdown(f"""
                 <div class="metric-card">
                   <h4>➖ No Change</h4>
                   <h1>{neutral}</h1>
+                  {format_interval(intervals.get('neutral'), '{:,.0f}')}
         </div>
     """, unsafe_allow_html=True)
 
         
         with col3:
-            declined = (df['Improvement'] < 0).sum()
+            declined = cohort['declined']
             st.markdown(f"""
                <div class="metric-card">
                     <h4>⚠️ Declined</h4>
                     <h1>{declined}</h1>
+                    {format_interval(intervals.get('declined'), '{:,.0f}')}
         </div>
     """, unsafe_allow_html=True)
 
+    # ==================== ANOMALY FLAGS ====================
+    st.markdown("---")
+    st.markdown("## 🚩 Flagged Students")
+    anomaly_cols = anomaly_columns(base_df, pre_col, post_col, group_cols)
+    anomalies = get_anomalies(base_df, anomaly_key(get_column_versions(base_df, get_dataset_version()), anomaly_cols),
+                              anomaly_cols)
+    show_anomaly_flags(base_df, anomalies, anomaly_cols, positions)
+
+    # ==================== LONGITUDINAL TRENDS ====================
+    waves = get_wave_columns(base_df)
+    if len(waves) >= 3:
+        show_longitudinal_analysis(base_df, get_dataset_version(), waves, positions)
+
+    # ==================== QUESTION ANALYSIS ====================
+    if st.session_state.item_statistics:
+        st.markdown("---")
+        st.markdown("## 🧮 Question Analysis")
+        show_item_statistics(st.session_state.item_statistics)
+
+    # ==================== TEXT ANALYTICS ====================
+    show_text_analytics(df, get_dataset_version())
+
     # ==================== ADDITIONAL ANALYSIS ====================
     
     # Check for additional columns
@@ -655,13 +3050,20 @@ def show_teacher_dashboard():
         numeric_df = df[other_numeric_cols].dropna()
         
         if not numeric_df.empty:
-            fig, ax = plt.subplots(figsize=(12, 8))
-            correlation = numeric_df.corr()
-            sns.heatmap(correlation, annot=True, fmt='.2f', cmap='coolwarm', 
-                       center=0, square=True, ax=ax, cbar_kws={'label': 'Correlation'})
-            ax.set_title('Correlation Between Metrics', fontsize=14, fontweight='bold', pad=20)
-            st.pyplot(fig)
-            plt.close()
+            def draw_correlation():
+                fig, ax = plt.subplots(figsize=(12, 8))
+                correlation = numeric_df.corr()
+                annot, fmt = True, '.2f'
+                if approximate:
+                    half_widths = correlation_intervals(correlation.to_numpy(), len(numeric_df))
+                    annot = np.vectorize(lambda r, h: f"{r:.2f}\n±{h:.2f}")(correlation.to_numpy(), half_widths)
+                    fmt = ''
+                sns.heatmap(correlation, annot=annot, fmt=fmt, cmap='coolwarm', 
+                           center=0, square=True, ax=ax, cbar_kws={'label': 'Correlation'})
+                ax.set_title('Correlation Between Metrics', fontsize=14, fontweight='bold', pad=20)
+                return fig
+
+            show_chart((*view_key, 'correlation'), draw_correlation)
             
             st.markdown("""
             <div class="info-box">
@@ -670,33 +3072,38 @@ def show_teacher_dashboard():
             </div>
             """, unsafe_allow_html=True)
     
+    # ==================== DATASET BROWSER ====================
+    st.markdown("---")
+    st.markdown("## 🗂️ Browse Dataset")
+    show_dataset_browser(base_df, get_dataset_version(), key="teacher_browser", subset=positions)
+    
     # ==================== DATA EXPORT ====================
     st.markdown("---")
     st.markdown("## 📥 Export Data")
     
-    col1, col2 = st.columns(2)
+    export_key = (get_dataset_version(), cohort_digest)
+    summary_cols = None
+    if pre_col and post_col:
+        summary_cols = [col for col in [name_col, email_col, pre_col, post_col] if col]
+    
+    col1, col2, col3 = st.columns(3)
     
     with col1:
-        csv = df.to_csv(index=False)
-        st.download_button(
-            label="📊 Download Full Dataset",
-            data=csv,
-            file_name="complete_analysis.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
+        show_export(('export', *export_key), "⚙️ Prepare Full Dataset", "Preparing full dataset",
+                    export_cohort_task, (base_df, positions, pre_col, post_col),
+                    "📊 Download Full Dataset", "complete_analysis.csv", "text/csv")
     
     with col2:
-        if 'Improvement' in df.columns:
-            summary_df = df[[name_col, email_col, pre_test_cols[0], post_test_cols[0], 'Improvement']].copy()
-            csv_summary = summary_df.to_csv(index=False)
-            st.download_button(
-                label="📈 Download Summary Report",
-                data=csv_summary,
-                file_name="improvement_summary.csv",
-                mime="text/csv",
-                use_container_width=True
-            )
+        if summary_cols:
+            show_export(('summary', *export_key), "⚙️ Prepare Summary Report", "Preparing summary report",
+                        export_cohort_task, (base_df, positions, pre_col, post_col, summary_cols),
+                        "📈 Download Summary Report", "improvement_summary.csv", "text/csv")
+    
+    with col3:
+        show_export(('bundle', *export_key), "⚙️ Prepare Report Bundle", "Preparing report bundle",
+                    report_bundle_task, (base_df, positions, pre_col, post_col, summary_cols,
+                                         st.session_state.item_statistics, overview),
+                    "📦 Download Report Bundle", "analysis_report.zip", "application/zip")
 
 # ==================== STUDENT DASHBOARD ====================
 
@@ -711,18 +3118,17 @@ def show_student_dashboard():
     
     col1, col2 = st.columns([3, 1])
     with col2:
-        if st.button("🚪 Logout"):
-            logout()
+        st.button("🚪 Logout", on_click=logout)
     
     if st.session_state.uploaded_data is None:
         st.warning("⚠️ No data available. Please contact admin.")
         return
     
-    df = st.session_state.uploaded_data.copy()
+    df = st.session_state.uploaded_data
     
     # Get student's data
     email_col = detect_email_column(df)
-    student_data = df[df[email_col].str.lower().str.strip() == st.session_state.user_email.lower()]
+    student_data = find_student_rows(df, st.session_state.user_email)
     
     if student_data.empty:
         st.error("❌ Your data not found in the system.")
@@ -732,8 +3138,7 @@ def show_student_dashboard():
     
     # Detect columns
     name_col = detect_name_column(df)
-    pre_test_cols = [col for col in df.columns if 'pre' in col.lower() and 'score' in col.lower()]
-    post_test_cols = [col for col in df.columns if 'post' in col.lower() and 'score' in col.lower()]
+    pre_test_cols, post_test_cols = get_test_columns(df, st.session_state.wave_columns)
     
     # ==================== PROFILE SECTION ====================
     st.markdown("## 👤 Your Profile")
@@ -772,6 +3177,7 @@ def show_student_dashboard():
         pre_score = student_row[pre_test_cols[0]]
         post_score = student_row[post_test_cols[0]]
         improvement = post_score - pre_score
+        core, manifest = get_core_for(get_dataset_version(), pre_test_cols[0], post_test_cols[0])
         
         col1, col2, col3 = st.columns(3)
         
@@ -834,8 +3240,12 @@ def show_student_dashboard():
             # Comparison with class average
             fig, ax = plt.subplots(figsize=(10, 6))
             
-            class_pre_avg = df[pre_test_cols[0]].mean()
-            class_post_avg = df[post_test_cols[0]].mean()
+            if core is not None:
+                class_pre_avg = core_summary(manifest, 'avg_pre')
+                class_post_avg = core_summary(manifest, 'avg_post')
+            else:
+                class_pre_avg = df[pre_test_cols[0]].mean()
+                class_post_avg = df[post_test_cols[0]].mean()
             
             x = np.arange(2)
             width = 0.35
@@ -855,6 +3265,10 @@ def show_student_dashboard():
             st.pyplot(fig)
             plt.close()
         
+        waves = get_wave_columns(df)
+        if len(waves) >= 3:
+            show_student_trajectory(student_data.index[0], waves)
+        
         # ==================== INSIGHTS ====================
         st.markdown("---")
         st.markdown("## 💡 Personalized Insights")
@@ -917,10 +3331,17 @@ def show_student_dashboard():
         st.markdown("---")
         st.markdown("## 📊 Your Class Standing")
         
-        df_with_improvement = df.copy()
-        df_with_improvement['Improvement'] = df[post_test_cols[0]] - df[pre_test_cols[0]]
+        if core is not None:
+            class_size = manifest['rows']
+            rank = int(core['rank'][student_data.index[0]])
+            class_avg_improvement = core_summary(manifest, 'avg_improvement')
+        else:
+            class_improvement = df[post_test_cols[0]] - df[pre_test_cols[0]]
+            class_size = len(df)
+            rank = class_size - (class_improvement < improvement).sum()
+            class_avg_improvement = class_improvement.mean()
         
-        percentile = (df_with_improvement['Improvement'] < improvement).sum() / len(df_with_improvement) * 100
+        percentile = (class_size - rank) / class_size * 100
         
         col1, col2, col3 = st.columns(3)
         
@@ -934,11 +3355,10 @@ def show_student_dashboard():
 
         
         with col2:
-            rank = len(df_with_improvement) - (df_with_improvement['Improvement'] < improvement).sum()
             st.markdown(f"""
                <div class="metric-card">
                     <h4>🏆 Class Rank</h4>
-                    <h1>{rank}/{len(df_with_improvement)}</h1>
+                    <h1>{rank}/{class_size}</h1>
                </div>
             """, unsafe_allow_html=True)
 
@@ -947,7 +3367,7 @@ def show_student_dashboard():
             st.markdown(f"""
               <div class="metric-card">
                    <h4>📈 Class Avg Improvement</h4>
-                   <h1>{df_with_improvement['Improvement'].mean():.1f}%</h1>
+                   <h1>{class_avg_improvement:.1f}%</h1>
               </div>
         """, unsafe_allow_html=True)
 
@@ -962,9 +3382,11 @@ def show_student_dashboard():
 
 # ==================== MAIN APPLICATION ====================
 
-def main():
-    """Main application logic"""
+def render_page():
+    """Set up the session and route to the login page or the role's dashboard"""
     initialize_session()
+    track_session()
+    start_metrics_api()
     
     if not st.session_state.authenticated:
         show_login_page()
@@ -977,5 +3399,14 @@ def main():
         elif st.session_state.user_role == 'Student':
             show_student_dashboard()
 
+def main():
+    """Main application logic"""
+    role = st.session_state.get('user_role')
+    mode = claim_profile_run(role) if role else None
+    if mode is None:
+        render_page()
+    else:
+        run_profiled(render_page, role, mode)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+import app
+
+
+def detect(df):
+    return app.detect_anomalies(df, 'PreScore', 'PostScore', 'Course', 'Email', ('PreScore', 'PostScore'))
+
+
+def course(name, improvements, pre=50.0):
+    n = len(improvements)
+    return pd.DataFrame({'Course': [name] * n, 'Email': [f'{name}{i}@x.edu' for i in range(n)],
+                         'PreScore': [pre] * n, 'PostScore': [pre + d for d in improvements]})
+
+
+def test_robust_z_is_relative_to_the_course():
+    df = pd.concat([course('A', [0, 2, 4, 6, 8, 10, 60]), course('B', [50, 52, 54, 56, 58, 60, 10], pre=0.0)],
+                   ignore_index=True)
+    anomalies = detect(df)
+    z = anomalies['robust_z']
+    # Median 6 and MAD 4: (60 - 6) / (4 / 0.6745)
+    assert np.isclose(z[6], 0.6745 * 54 / 4)
+    assert np.isclose(z[13], -0.6745 * 44 / 4)
+    assert (np.flatnonzero(anomalies['flags'] & 1)).tolist() == [6, 13]
+
+
+def test_uniform_course_does_not_flag_a_one_point_difference():
+    anomalies = detect(course('A', [10] * 10 + [11]))
+    assert np.isclose(anomalies['robust_z'][-1], 1 / app.MIN_JUMP_SPREAD)
+    assert not (anomalies['flags'] & 1).any()
+
+
+def test_uniform_course_still_flags_a_large_jump():
+    df = course('A', [10] * 19 + [95])
+    df.loc[19, 'PreScore'] = 5.0
+    anomalies = detect(df)
+    assert (np.flatnonzero(anomalies['flags'] & 1)).tolist() == [19]
+
+
+def test_small_courses_are_not_checked_for_jumps():
+    anomalies = detect(course('A', [0, 0, 90]))
+    assert np.isnan(anomalies['robust_z']).all()
+    assert not (anomalies['flags'] & 1).any()
+
+
+def test_range_missing_and_duplicate_checks():
+    df = course('A', [0, 0, 0, 0, 0, 0])
+    df.loc[0, 'PostScore'] = 120.0
+    df.loc[1, 'PreScore'] = np.nan
+    df.loc[3, 'Email'] = ' A2@X.edu'
+    labels = app.flag_labels(detect(df)['flags'])
+    assert list(labels) == ['Unusual jump, Score out of range', 'Missing pre/post', 'Duplicate email', 'Duplicate email', '', '']
+
+
+def test_student_absent_from_an_answer_keyed_test_is_flagged_missing():
+    df = pd.DataFrame({'Course': ['A'] * 6, 'Email': [f'{i}@x.edu' for i in range(6)],
+                       'Q1': ['a', 'b', 'a', 'a', 'b', None], 'Q2': ['c', 'c', 'd', 'c', 'c', None],
+                       'P1': ['a', 'a', 'a', 'b', 'a', 'a'], 'P2': ['c', 'c', 'c', 'c', 'd', 'c']})
+    scored, _ = app.apply_answer_keys(df, {'pre': {'Q1': 'a', 'Q2': 'c'}, 'post': {'P1': 'a', 'P2': 'c'}})
+    anomalies = app.detect_anomalies(scored, 'PreTestScore', 'PostTestScore', 'Course', 'Email',
+                                     ('PreTestScore', 'PostTestScore'))
+    assert list(app.flag_labels(anomalies['flags'])) == ['', '', '', '', '', 'Missing pre/post']
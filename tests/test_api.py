@@ -0,0 +1,85 @@
+import io
+import json
+import threading
+from http.client import HTTPConnection
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import app
+
+
+@pytest.fixture
+def published(monkeypatch):
+    frame = pd.DataFrame({'Name': ['Ann', 'Ben', 'Cy', 'Di', 'Ed'],
+                          'Email': ['a@x.edu', 'b@x.edu', 'c@x.edu', 'd@x.edu', 'e@x.edu'],
+                          'PreScore': [10.0, 20.0, 30.0, 40.0, np.nan], 'PostScore': [70.0, 30.0, 30.0, 20.0, 50.0]})
+    core = app.build_score_core(frame, 'PreScore', 'PostScore')
+    manifest = {'stamp': 'abc123', 'version': 'v1', 'rows': len(frame), 'pre': 'PreScore', 'post': 'PostScore',
+                'published': 1.0, 'summary': {'avg_pre': 25.0, 'avg_post': 40.0, 'avg_improvement': 7.5},
+                'category_counts': [1, 0, 1, 2]}
+    store = dict(app.get_dataset_store.__wrapped__(), version='v1', data=frame, published=1.0)
+    cache = {'stamp': None, 'responses': {}, 'lock': threading.Lock()}
+    monkeypatch.setattr(app, 'API_TOKEN', 'secret')
+    monkeypatch.setattr(app, 'get_shared_core', lambda: {'core': core, 'manifest': manifest})
+    monkeypatch.setattr(app, 'get_dataset_store', lambda: store)
+    monkeypatch.setattr(app, 'get_api_cache', lambda: cache)
+    return store
+
+
+@pytest.fixture
+def get(published):
+    server = app.ThreadingHTTPServer(('127.0.0.1', 0), app.MetricsAPIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def get(path, token='secret', **headers):
+        connection = HTTPConnection(*server.server_address, timeout=10)
+        connection.request('GET', path, headers={'Authorization': f'Bearer {token}', **headers})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+
+    yield get
+    server.shutdown()
+    server.server_close()
+
+
+def test_wrong_token_is_rejected(get):
+    assert get('/api/v1/summary', token='guess')[0] == 401
+    assert get('/api/v1/nothing')[0] == 404
+
+
+def test_students_are_paginated(get):
+    status, headers, body = get('/api/v1/students?offset=1&limit=2')
+    assert status == 200 and headers['ETag'] == '"abc123"'
+    page = json.loads(body)
+    assert (page['total'], page['offset'], page['limit'], page['version']) == (5, 1, 2, 'v1')
+    rows = [dict(zip(page['columns'], row)) for row in page['data']]
+    assert [row['email'] for row in rows] == ['b@x.edu', 'c@x.edu']
+    assert [row['improvement'] for row in rows] == [10.0, 0.0]
+    assert [row['category'] for row in rows] == ['Moderate (0-19%)', 'Moderate (0-19%)']
+    last = json.loads(get('/api/v1/students?offset=4&limit=100000')[2])
+    assert last['limit'] == app.API_MAX_LIMIT
+    assert [dict(zip(last['columns'], row))['category'] for row in last['data']] == [None]
+    assert get('/api/v1/students?offset=x')[0] == 400
+
+
+def test_students_as_arrow(get):
+    status, headers, body = get('/api/v1/students?format=arrow')
+    assert status == 200 and headers['Content-Type'] == app.ARROW_MIME
+    table = pa.ipc.open_stream(io.BytesIO(body)).read_all()
+    assert table.column('name').to_pylist() == ['Ann', 'Ben', 'Cy', 'Di', 'Ed']
+    assert table.schema.metadata[b'total'] == b'5'
+
+
+def test_matching_etag_is_answered_without_building(get, monkeypatch):
+    etag = get('/api/v1/summary')[1]['ETag']
+    monkeypatch.setattr(app, 'build_api_response', lambda *args: pytest.fail("built a response for a 304"))
+    status, headers, body = get('/api/v1/students?offset=2', **{'If-None-Match': etag})
+    assert status == 304 and body == b'' and headers['ETag'] == etag
+
+
+def test_rows_from_another_version_are_not_served(get, published):
+    published['version'] = 'v2'
+    assert get('/api/v1/students')[0] == 503
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def test_weighted_estimate_with_equal_weights_is_the_sample_mean():
+    values = np.array([1.0, 2.0, 3.0, 4.0, np.nan])
+    mean, half_width = app.weighted_estimate(values, np.ones(5))
+    assert mean == 2.5
+    assert np.isclose(half_width, app.Z_95 * np.std(values[:4], ddof=1) / 2)
+
+
+def test_weighted_estimate_weights_and_degenerate_inputs():
+    mean, _ = app.weighted_estimate(np.array([0.0, 10.0]), np.array([3.0, 1.0]))
+    assert mean == 2.5
+    assert app.weighted_estimate(np.array([7.0, np.nan]), np.ones(2))[0] == 7.0
+    assert np.isnan(app.weighted_estimate(np.array([7.0, np.nan]), np.ones(2))[1])
+    assert np.isnan(app.weighted_estimate(np.array([np.nan]), np.ones(1))[0])
+
+
+def population(n=20000):
+    rng = np.random.default_rng(1)
+    course = rng.choice(['CS', 'IT', 'EE'], n, p=[0.7, 0.29, 0.01])
+    return pd.DataFrame({'Course': course, 'PreScore': rng.normal(50, 10, n) + (course == 'EE') * 30})
+
+
+@pytest.fixture
+def sample(monkeypatch):
+    monkeypatch.setattr(app, 'SAMPLE_SIZE', 2000)
+    df = population()
+    return df, app.build_stratified_sample(df)
+
+
+def test_stratified_sample_weights_add_up_to_each_stratum(sample):
+    df, sample = sample
+    assert sample['strata_col'] == 'Course' and sample['population'] == len(df)
+    strata = sample['strata'].set_index('Stratum')
+    # The 1% stratum gets the floor instead of its proportional ~20 rows
+    assert strata.loc['EE', 'Sampled'] == app.MIN_STRATUM_SAMPLE
+    labels = df['Course'].to_numpy()[sample['positions']]
+    for stratum, row in strata.iterrows():
+        assert np.isclose(sample['weights'][labels == stratum].sum(), row['Population'])
+    again = app.build_stratified_sample(df)
+    assert np.array_equal(again['positions'], sample['positions'])
+
+
+def test_sample_estimate_covers_the_true_mean(sample):
+    df, sample = sample
+    values = df['PreScore'].to_numpy()[sample['positions']]
+    mean, half_width = app.weighted_estimate(values, sample['weights'])
+    assert abs(mean - df['PreScore'].mean()) < half_width < 1.0
+
+
+def test_sample_cohort_rescales_weights_to_the_cohort(sample):
+    df, sample = sample
+    rows, weights = app.sample_cohort(sample, None)
+    assert rows is sample['positions'] and weights is sample['weights']
+    cohort = np.flatnonzero(df['Course'].to_numpy() != 'CS')
+    rows, weights = app.sample_cohort(sample, cohort)
+    assert np.isin(rows, cohort).all()
+    assert len(rows) == np.isin(sample['positions'], cohort).sum()
+    assert np.isclose(weights.sum(), len(cohort))
+    rows, weights = app.sample_cohort(sample, np.array([], dtype=np.int64))
+    assert rows.size == 0 and weights.size == 0
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+import app
+
+
+def frame():
+    return pd.DataFrame({'Course': ['CS', 'CS', 'IT', 'IT', 'CS', None],
+                         'Section': ['A', 'B', 'A', 'B', 'A', 'A'],
+                         'PreScore': [10.0, 20.0, 30.0, np.nan, 50.0, 60.0],
+                         'PostScore': [20.0, 10.0, 30.0, 40.0, 80.0, np.nan]})
+
+
+def build(df):
+    return app.get_cohort_index.__wrapped__(df, 'k', 'PreScore', 'PostScore', ('Course', 'Section'))
+
+
+def test_no_filter_is_everyone():
+    positions, stats = app.select_cohort(build(frame()), {'Course': [], 'Section': []})
+    assert positions is None
+    assert stats['students'] == 6 and stats['pre_n'] == 5 and stats['post_n'] == 5
+
+
+def test_single_column_uses_group_stats():
+    positions, stats = app.select_cohort(build(frame()), {'Course': ['CS', '(blank)']})
+    assert positions.tolist() == [0, 1, 4, 5]
+    assert stats['students'] == 4 and stats['pre_sum'] == 140.0 and stats['improved'] == 2
+
+
+def test_multiple_columns_intersect():
+    df = frame()
+    positions, stats = app.select_cohort(build(df), {'Course': ['CS', 'IT'], 'Section': ['A']})
+    assert positions.tolist() == [0, 2, 4]
+    expected = app.cohort_parts(df, 'PreScore', 'PostScore').iloc[[0, 2, 4]].sum()
+    pd.testing.assert_series_equal(stats, expected)
+    summary = app.summarize_cohort(stats)
+    assert summary['students'] == 3 and summary['avg_pre'] == 30.0 and summary['neutral'] == 1
+
+
+def test_empty_intersection():
+    positions, stats = app.select_cohort(build(frame()), {'Course': ['IT'], 'Section': ['A']})
+    assert positions.tolist() == [2]
+    positions, stats = app.select_cohort(build(frame()), {'Course': ['(blank)'], 'Section': ['B']})
+    assert len(positions) == 0 and stats['students'] == 0
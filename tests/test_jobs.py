@@ -0,0 +1,106 @@
+import threading
+import zipfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def queue():
+    return app.JobQueue(1)
+
+
+def wait(job):
+    job.future.result(timeout=10)
+    return job
+
+
+def test_submit_reuses_the_job_for_a_key(queue):
+    calls = []
+    job = wait(queue.submit('k', 'Label', lambda job, x: calls.append(x) or x * 2, 21))
+    assert job.status == 'done' and job.result == 42 and job.progress == 1.0
+    assert queue.submit('k', 'Label', lambda job, x: calls.append(x), 0) is job
+    assert calls == [21]
+    assert queue.get(job.id) is job
+
+
+def test_failed_job_is_kept_until_discarded(queue):
+    def fail(job):
+        raise ValueError("bad upload")
+
+    job = wait(queue.submit('k', 'Label', fail))
+    assert job.status == 'failed' and job.error == "bad upload"
+    assert queue.submit('k', 'Label', lambda job: 'ok') is job
+    queue.discard(job.id)
+    retried = wait(queue.submit('k', 'Label', lambda job: 'ok'))
+    assert retried is not job and retried.result == 'ok'
+    assert queue.get(job.id) is None
+
+
+def test_cancel_stops_a_running_job_at_its_next_update(queue):
+    started, release = threading.Event(), threading.Event()
+
+    def task(job):
+        started.set()
+        release.wait(10)
+        job.update(0.5)
+        return 'finished'
+
+    job = queue.submit('k', 'Label', task)
+    assert started.wait(10) and job.active
+    job.cancel()
+    release.set()
+    wait(job)
+    assert job.status == 'cancelled' and job.result is None
+    assert queue.submit('k', 'Label', task) is job
+
+
+def test_cancel_prevents_a_queued_job_from_starting(queue):
+    release = threading.Event()
+    blocker = queue.submit('blocker', 'Label', lambda job: release.wait(10))
+    ran = []
+    job = queue.submit('k', 'Label', lambda job: ran.append(True))
+    job.cancel()
+    release.set()
+    wait(blocker)
+    assert job.status == 'cancelled' and not ran
+
+
+def test_find_does_not_submit(queue):
+    assert queue.find('k') is None
+    job = wait(queue.submit('k', 'Label', lambda job: 1))
+    assert queue.find('k') is job
+    assert queue.jobs() == [job]
+
+
+def test_report_bundle_streams_the_cohort_in_chunks(monkeypatch):
+    monkeypatch.setattr(app, 'CSV_CHUNK_ROWS', 2)
+    df = pd.DataFrame({'Name': list('abcde'), 'Pre': [1.0, 2.0, 3.0, 4.0, 5.0], 'Post': [2.0, 2.0, 5.0, 4.0, 9.0]})
+    job = app.Job('k', 'Label')
+    data = app.report_bundle_task(job, df, np.array([0, 2, 4]), 'Pre', 'Post', ['Name'], {}, {'Students': 3})
+    bundle = zipfile.ZipFile(BytesIO(data))
+    expected = app.cohort_frame(df, np.array([0, 2, 4]), 'Pre', 'Post')
+    assert bundle.read('complete_analysis.csv').decode() == expected.to_csv(index=False)
+    assert bundle.read('improvement_summary.csv').decode() == expected[['Name', 'Improvement']].to_csv(index=False)
+    assert job.progress == 0.9
+
+
+def test_cancelled_export_stops_between_chunks(monkeypatch):
+    monkeypatch.setattr(app, 'CSV_CHUNK_ROWS', 2)
+    job = app.Job('k', 'Label')
+    seen = []
+
+    def update(progress, message=''):
+        seen.append(progress)
+        if len(seen) == 2:
+            job.cancel()
+        app.Job.update(job, progress, message)
+
+    job.update = update
+    with pytest.raises(app.JobCancelled):
+        app.export_csv_task(job, pd.DataFrame({'x': range(10)}))
+    assert len(seen) == 2
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+import app
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(app.time, 'time', clock)
+    return clock
+
+
+def array(kb):
+    return np.zeros(kb * 1024, dtype=np.uint8)
+
+
+def test_evicts_the_stalest_biggest_cheapest_entry_first(clock):
+    manager = app.MemoryManager(10 * 1024 ** 2)
+    released = []
+    manager.track('old', 'A', array(4000), release=lambda: released.append('old'))
+    clock.now += 60
+    manager.track('expensive', 'A', array(4000), release=lambda: released.append('expensive'), cost=100.0)
+    manager.track('pinned', 'A', array(1000))
+    clock.now += 60
+    manager.track('new', 'B', array(4000), release=lambda: released.append('new'))
+    assert released == ['old']
+    assert manager.total_bytes() < manager.budget_bytes
+    assert set(manager.usage()['Category']) == {'A', 'B'}
+
+
+def test_never_evicts_the_entry_being_tracked_or_unreleasable_ones(clock):
+    manager = app.MemoryManager(1024)
+    released = []
+    manager.track('pinned', 'A', array(10))
+    manager.track('big', 'A', array(100), release=lambda: released.append('big'))
+    assert released == []
+    assert manager.total_bytes() > manager.budget_bytes
+    manager.enforce()
+    assert released == ['big']
+    assert manager.usage()['Entries'].tolist() == [1]
+
+
+def test_retracking_the_same_object_refreshes_it_without_remeasuring(clock, monkeypatch):
+    manager = app.MemoryManager(10 * 1024 ** 2)
+    data = array(10)
+    manager.track('k', 'A', data)
+    monkeypatch.setattr(app, 'estimate_nbytes', lambda obj: pytest.fail("re-measured"))
+    clock.now += 5
+    manager.track('k', 'A', data)
+    manager.touch('k')
+    assert manager._entries['k']['last_used'] == clock.now
+
+
+def test_release_idle_only_releases_idle_entries_that_opt_in(clock):
+    manager = app.MemoryManager(10 * 1024 ** 2)
+    released = []
+
+    def broken():
+        raise RuntimeError("already gone")
+
+    manager.track('session', 'S', array(1), release=lambda: released.append('session'), idle_after=30)
+    manager.track('fresh', 'S', array(1), release=lambda: released.append('fresh'), idle_after=300)
+    manager.track('broken', 'S', array(1), release=broken, idle_after=30)
+    manager.track('cache', 'C', array(1), release=lambda: released.append('cache'))
+    clock.now += 60
+    assert manager.release_idle() == 2
+    assert released == ['session']
+    assert set(manager._entries) == {'fresh', 'cache'}
+
+
+def test_tracked_resource_recomputes_after_release(clock, monkeypatch):
+    manager = app.MemoryManager(10 * 1024 ** 2)
+    monkeypatch.setattr(app, 'get_memory_manager', lambda: manager)
+    calls = []
+
+    @app.tracked_resource(max_entries=4)
+    def build_for_memory_test(_data, version):
+        calls.append(version)
+        return array(100)
+
+    first = build_for_memory_test(None, 'v1')
+    assert build_for_memory_test(None, 'v1') is first and calls == ['v1']
+    assert ('build_for_memory_test', 'v1') in manager._entries
+    manager.budget_bytes = 0
+    manager.enforce()
+    assert manager._entries == {}
+    assert build_for_memory_test(None, 'v1') is not first and calls == ['v1', 'v1']
@@ -0,0 +1,50 @@
+import cProfile
+import os
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def state(monkeypatch):
+    state = app.get_profiler_state.__wrapped__()
+    monkeypatch.setattr(app, 'get_profiler_state', lambda: state)
+    return state
+
+
+def captured():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    sorted(range(1000), key=lambda x: -x)
+    profiler.disable()
+    return profiler
+
+
+def test_profiles_go_to_a_private_directory(state, monkeypatch, tmp_path):
+    profile_dir = tmp_path / 'profiles'
+    monkeypatch.setattr(app, 'PROFILE_DIR', str(profile_dir))
+    app.record_profile(captured(), 'Teacher', 'Deterministic', 0.5)
+    assert oct(os.stat(profile_dir).st_mode & 0o777) == '0o700'
+    capture = state['captures'][-1]
+    assert os.path.dirname(capture['File']) == str(profile_dir) and os.path.exists(capture['File'])
+    assert not capture['hot'].empty
+
+
+def test_no_profile_is_written_to_a_directory_open_to_others(state, monkeypatch, tmp_path):
+    profile_dir = tmp_path / 'profiles'
+    profile_dir.mkdir()
+    os.chmod(profile_dir, 0o777)
+    monkeypatch.setattr(app, 'PROFILE_DIR', str(profile_dir))
+    app.record_profile(captured(), 'Teacher', 'Deterministic', 0.5)
+    assert os.listdir(profile_dir) == []
+    assert state['captures'][-1]['File'] == '' and not state['captures'][-1]['hot'].empty
+
+
+def test_old_captures_are_removed(state, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    monkeypatch.setattr(app, 'MAX_PROFILES', 2)
+    for _ in range(3):
+        app.record_profile(captured(), 'Admin', 'Deterministic', 0.1)
+    assert len(state['captures']) == 2
+    assert sorted(os.listdir(tmp_path / 'profiles')) == sorted(os.path.basename(c['File']) for c in state['captures'])
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+import app
+
+
+def test_answers_match_ignoring_case_whitespace_and_number_format():
+    responses = pd.DataFrame({'Q1': [' b', 'B', 'c', None], 'Q2': [1.0, 1.0, 2.0, np.nan], 'Q3': ['1', ' 1 ', 'x', '']})
+    scores, correct = app.score_responses(responses, ['B', '1', 1])
+    assert correct.tolist() == [[True, True, True], [True, True, True], [False, False, False], [False, False, False]]
+    assert scores.tolist()[:3] == [100.0, 100.0, 0.0]
+
+
+def test_student_who_left_every_question_blank_scores_nan():
+    responses = pd.DataFrame({'Q1': ['A', None, '  ', 'B'], 'Q2': [np.nan, np.nan, np.nan, 'C']})
+    scores, _ = app.score_responses(responses, ['A', 'C'])
+    assert scores[0] == 50.0 and scores[3] == 50.0
+    assert scores[1:3].isna().all()
+
+
+def test_blank_key_answer_never_counts_as_correct():
+    responses = pd.DataFrame({'Q1': ['A', None]})
+    _, correct = app.score_responses(responses, [''])
+    assert not correct.any()
+
+
+def test_item_statistics():
+    correct = np.array([[1, 1, 0], [1, 1, 0], [1, 1, 1], [0, 0, 1], [0, 0, 1], [1, 0, 0]], dtype=bool)
+    stats = app.compute_item_statistics(correct, ['Q1', 'Q2', 'Q3'])
+    assert stats['Question'].tolist() == ['Q1', 'Q2', 'Q3']
+    assert stats['Difficulty'].tolist() == [4 / 6, 0.5, 0.5]
+    assert stats['Correct'].tolist() == [4, 3, 3]
+    # Q2 agrees with the rest of the test, Q3 contradicts it
+    assert stats['Discrimination'][1] > 0 > stats['Discrimination'][2]
+
+
+def test_item_statistics_constant_question_has_no_discrimination():
+    correct = np.array([[1, 1], [1, 0], [1, 1]], dtype=bool)
+    stats = app.compute_item_statistics(correct, ['Q1', 'Q2'])
+    assert np.isnan(stats['Discrimination'][0])
+
+
+def test_apply_answer_keys_adds_score_columns():
+    df = pd.DataFrame({'Q1': ['A', 'B', None], 'Q2': ['C', 'C', None]})
+    scored, item_statistics = app.apply_answer_keys(df, {'pre': {'Q1': 'A', 'Q2': 'C'}, 'post': {'Q1': ' '}})
+    assert scored['PreTestScore'].tolist()[:2] == [100.0, 50.0]
+    assert np.isnan(scored['PreTestScore'][2])
+    assert 'PostTestScore' not in scored
+    assert list(item_statistics) == ['pre']
+    # Students who did not sit the test are left out of the item statistics
+    assert item_statistics['pre']['Difficulty'].tolist() == [0.5, 1.0]
+    assert 'PreTestScore' not in df
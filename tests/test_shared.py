@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    queue = app.JobQueue(1)
+    monkeypatch.setattr(app, 'get_job_queue', lambda: queue)
+    return queue
+
+
+def frame(post):
+    return pd.DataFrame({'Email': ['a@x.edu', 'b@x.edu'], 'PreScore': [10.0, 20.0], 'PostScore': post})
+
+
+def test_republishing_an_earlier_version_rewrites_the_manifest(queue, monkeypatch):
+    written = []
+    monkeypatch.setattr(app, 'write_shared_dataset_task', lambda job, df, version, *args: written.append(version))
+    a, b = frame([15.0, 25.0]), frame([30.0, 40.0])
+    for df, version, published in [(a, 'a', 1.0), (b, 'b', 2.0), (a, 'a', 3.0)]:
+        app.share_published_dataset(df, version, {}, None, published, None).future.result(timeout=10)
+    assert written == ['a', 'b', 'a']
+
+
+def test_shared_dataset_round_trip(queue, monkeypatch, tmp_path):
+    shared = tmp_path / 'shared'
+    monkeypatch.setattr(app, 'SHARED_DIR', str(shared))
+    df = frame([15.0, np.nan])
+    job = app.share_published_dataset(df, 'v1', {}, None, 1.0, 1.0)
+    job.future.result(timeout=10)
+    assert job.status == 'done', job.error
+    assert oct(os.stat(shared).st_mode & 0o777) == '0o700'
+    manifest = job.result
+    assert (manifest['version'], manifest['pre'], manifest['post'], manifest['rows']) == ('v1', 'PreScore', 'PostScore', 2)
+    core = np.load(shared / f"core-{manifest['stamp']}.npy", mmap_mode='r')
+    assert core['improvement'][0] == 5.0 and np.isnan(core['improvement'][1])
+
+    store = dict(app.get_dataset_store.__wrapped__())
+    monkeypatch.setattr(app, 'get_dataset_store', lambda: store)
+    monkeypatch.setattr(app, 'get_memory_manager', lambda: app.MemoryManager(1 << 30))
+    app.load_shared_dataset(manifest)
+    assert store['version'] == 'v1'
+    pd.testing.assert_frame_equal(store['data'], df, check_dtype=False)
+
+
+def test_shared_dir_open_to_others_is_refused(queue, monkeypatch, tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir(mode=0o777)
+    os.chmod(shared, 0o777)
+    monkeypatch.setattr(app, 'SHARED_DIR', str(shared))
+    job = app.share_published_dataset(frame([1.0, 2.0]), 'v1', {}, None, 1.0, 1.0)
+    job.future.result(timeout=10)
+    assert job.status == 'failed'
+    assert os.listdir(shared) == []
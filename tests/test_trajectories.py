@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+import app
+
+
+def test_slopes_and_deltas():
+    scores = np.array([[10.0, 20.0, 30.0], [30.0, 20.0, 10.0], [10.0, np.nan, 30.0], [np.nan, 50.0, np.nan]])
+    trajectories = app.compute_trajectories(scores)
+    assert np.allclose(trajectories['slopes'][:3], [10.0, -10.0, 10.0])
+    assert np.isnan(trajectories['slopes'][3])
+    assert trajectories['observed'].tolist() == [3, 3, 2, 1]
+    assert trajectories['deltas'][0].tolist() == [10.0, 10.0]
+    assert np.isnan(trajectories['deltas'][2]).all()
+
+
+def test_slopes_match_least_squares():
+    rng = np.random.default_rng(0)
+    scores = rng.uniform(0, 100, size=(20, 4))
+    expected = [np.polyfit(np.arange(4), row, 1)[0] for row in scores]
+    assert np.allclose(app.compute_trajectories(scores)['slopes'], expected)
+
+
+def scores_frame(*columns):
+    return pd.DataFrame({col: [50.0, 60.0] for col in columns})
+
+
+def test_extra_score_columns_are_not_waves():
+    df = scores_frame('PreTestScore', 'Q1Score', 'Q2Score', 'ConfidenceScore', 'PostTestScore', 'FinalProjectScore')
+    assert app.detect_wave_columns(df) == ['PreTestScore', 'PostTestScore']
+    assert app.get_test_columns(df, None) == (['PreTestScore'], ['PostTestScore'])
+
+
+def test_waves_order_by_keyword_then_number():
+    df = scores_frame('PostScore', 'Wave10Score', 'MidtermScore', 'Wave2Score', 'BaselineScore')
+    assert app.detect_wave_columns(df) == ['BaselineScore', 'MidtermScore', 'Wave2Score', 'Wave10Score', 'PostScore']
+
+
+def test_detected_waves_do_not_move_the_pre_post_pair():
+    df = scores_frame('PreTestScore', 'MidtermScore', 'PostTestScore', 'FinalProjectScore')
+    assert app.get_test_columns(df, None) == (['PreTestScore'], ['PostTestScore'])
+
+
+def test_configured_waves_set_the_pre_post_pair_when_they_fit():
+    df = scores_frame('PreTestScore', 'PostTestScore', 'FinalProjectScore')
+    assert app.get_test_columns(df, ['PreTestScore', 'PostTestScore', 'FinalProjectScore']) == (
+        ['PreTestScore'], ['FinalProjectScore'])
+    assert app.get_test_columns(df, ['PreTestScore', 'RetakeScore']) == (['PreTestScore'], ['PostTestScore'])
+
+
+def test_saved_wave_order_reaches_following_sessions(monkeypatch):
+    data = scores_frame('PreTestScore', 'MidtermScore', 'PostTestScore')
+    store = dict(app.get_dataset_store.__wrapped__(), version='v1', data=data,
+                 wave_columns=['PreTestScore', 'MidtermScore', 'PostTestScore'], waves_set=20.0)
+    session = SimpleNamespace(uploaded_data=data, dataset_version='v1', wave_columns=None, follows_published=True)
+    monkeypatch.setattr(app, 'get_dataset_store', lambda: store)
+    monkeypatch.setattr(app, 'get_shared_core', lambda: None)
+    monkeypatch.setattr(app.st, 'session_state', session)
+    app.adopt_published_dataset()
+    assert session.wave_columns == store['wave_columns']
+    session.follows_published = False
+    session.wave_columns = ['PreTestScore', 'PostTestScore']
+    app.adopt_published_dataset()
+    assert session.wave_columns == ['PreTestScore', 'PostTestScore']
+
+
+def test_shared_wave_order_is_loaded_only_when_newer(monkeypatch):
+    store = dict(app.get_dataset_store.__wrapped__(), version='v1', wave_columns=['A', 'B'], waves_set=20.0,
+                 published=5.0)
+    monkeypatch.setattr(app, 'get_dataset_store', lambda: store)
+    manifest = {'version': 'v1', 'wave_columns': ['B', 'A'], 'waves_set': 10.0, 'published': 5.0}
+    app.load_shared_dataset(manifest)
+    assert store['wave_columns'] == ['A', 'B']
+    app.load_shared_dataset(dict(manifest, waves_set=30.0))
+    assert store['wave_columns'] == ['B', 'A'] and store['waves_set'] == 30.0
@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def frame():
+    return pd.DataFrame({'Email': ['a@x.edu', 'b@x.edu', 'c@x.edu'], 'PreScore': [10.0, 20.0, 30.0],
+                         'PostScore': [15.0, 25.0, 35.0]})
+
+
+def test_row_hashes_depend_on_content_and_column_order():
+    df = frame()
+    hashes = app.compute_row_hashes(df)
+    assert np.array_equal(hashes, app.compute_row_hashes(frame()))
+    edited = frame()
+    edited.loc[1, 'PostScore'] = 99.0
+    assert (hashes != app.compute_row_hashes(edited)).tolist() == [False, True, False]
+    assert (hashes != app.compute_row_hashes(df[['Email', 'PostScore', 'PreScore']])).all()
+
+
+def test_dataset_and_column_versions():
+    df, edited = frame(), frame()
+    edited.loc[0, 'PreScore'] = 11.0
+    assert app.compute_dataset_version(df) == app.compute_dataset_version(frame())
+    assert app.compute_dataset_version(df) != app.compute_dataset_version(edited)
+    versions = app.compute_column_versions(df, app.hash_columns(df))
+    edited_versions = app.compute_column_versions(edited, app.hash_columns(edited))
+    assert [col for col in versions if versions[col] != edited_versions[col]] == ['PreScore']
+
+
+def test_diff_pairs_rows_by_email():
+    old = frame()
+    new = pd.concat([frame().iloc[[2, 0]], pd.DataFrame({'Email': ['D@x.edu'], 'PreScore': [1.0],
+                                                          'PostScore': [2.0]})], ignore_index=True)
+    new.loc[1, 'PostScore'] = 50.0
+    diff = app.diff_datasets(old, app.compute_row_hashes(old), new, app.compute_row_hashes(new))
+    assert diff['keyed'] and not diff['aligned']
+    assert diff['added'].tolist() == [2]
+    assert diff['removed'].tolist() == [1]
+    assert diff['removed_keys'] == ['b@x.edu']
+    assert diff['modified'].tolist() == [1]
+    assert diff['unchanged'] == 1
+    assert diff['columns'][['Column', 'Rows']].values.tolist() == [['PostScore', 1]]
+
+
+def test_diff_without_email_pairs_on_content():
+    old = frame().drop(columns='Email')
+    new = old.copy()
+    new.loc[0, 'PreScore'] = 0.0
+    diff = app.diff_datasets(old, app.compute_row_hashes(old), new, app.compute_row_hashes(new))
+    assert not diff['keyed']
+    assert diff['added'].tolist() == [0] and diff['removed'].tolist() == [0]
+    assert len(diff['modified']) == 0 and diff['unchanged'] == 2
+
+
+def test_row_delta_only_for_in_place_edits():
+    old = pd.concat([frame()] * 4, ignore_index=True)
+    old['Email'] = [f's{i}@x.edu' for i in range(len(old))]
+    new = old.copy()
+    new.loc[2, 'PostScore'] = 0.0
+    old_hashes, new_hashes = app.compute_row_hashes(old), app.compute_row_hashes(new)
+    old_versions = app.compute_column_versions(old, app.hash_columns(old))
+    new_versions = app.compute_column_versions(new, app.hash_columns(new))
+    published = {'data': old, 'version': 'v1', 'column_versions': old_versions}
+    diff = app.diff_datasets(old, old_hashes, new, new_hashes, aligned=True)
+    delta = app.row_delta(diff, published, new, new_versions)
+    assert delta['base'] == 'v1'
+    assert delta['rows'].tolist() == [2]
+    assert delta['columns'] == {'PostScore'}
+    assert app.row_delta(app.diff_datasets(old, old_hashes, new, new_hashes), published, new, new_versions) is None
+    new.loc[:2, 'PostScore'] = 0.0
+    new_hashes = app.compute_row_hashes(new)
+    new_versions = app.compute_column_versions(new, app.hash_columns(new))
+    diff = app.diff_datasets(old, old_hashes, new, new_hashes, aligned=True)
+    assert app.row_delta(diff, published, new, new_versions) is None
+
+
+def edit_and_publish(store, df, edit):
+    """Publish an edited copy of the published frame the way an upload does, returning it"""
+    new = df.copy()
+    edit(new)
+    column_hashes = app.hash_columns(new)
+    row_hashes = app.compute_row_hashes(new, column_hashes)
+    versions = app.compute_column_versions(new, column_hashes)
+    diff = app.diff_datasets(store['data'], store['row_hashes'], new, row_hashes, aligned=True)
+    store.update(data=new, version=app.compute_dataset_version(new, row_hashes), row_hashes=row_hashes,
+                 column_versions=versions, delta=app.row_delta(diff, store, new, versions))
+    return new
+
+
+@pytest.fixture
+def store(monkeypatch):
+    rng = np.random.default_rng(7)
+    n = 400
+    df = pd.DataFrame({'Email': [f's{i}@x.edu' for i in range(n)], 'Course': rng.choice(['CS', 'IT', None], n),
+                       'Section': rng.choice(['A', 'B'], n), 'PreScore': rng.integers(0, 100, n).astype(float),
+                       'PostScore': rng.integers(0, 100, n).astype(float), 'Feedback': rng.choice(['ok', 'great'], n)})
+    column_hashes = app.hash_columns(df)
+    row_hashes = app.compute_row_hashes(df, column_hashes)
+    store = dict(app.get_dataset_store.__wrapped__(), data=df, row_hashes=row_hashes,
+                 version=app.compute_dataset_version(df, row_hashes),
+                 column_versions=app.compute_column_versions(df, column_hashes))
+    monkeypatch.setattr(app, 'get_dataset_store', lambda: store)
+    monkeypatch.setattr(app, 'get_memory_manager', lambda: app.MemoryManager(1 << 30))
+    return store
+
+
+def indexes(store):
+    df, version, versions = store['data'], store['version'], store['column_versions']
+    groups = ('Course', 'Section')
+    key = app.columns_version(versions, ['PreScore', 'PostScore', *groups])
+    return (app.get_cohort_index(df, key, 'PreScore', 'PostScore', groups),
+            app.get_search_index(df, versions['Feedback'], 'Feedback'),
+            app.get_row_search_index(df, version))
+
+
+def rebuilt(store):
+    df = store['data']
+    columns = [app.search_text(df[col]).reset_index(drop=True) for col in df.columns]
+    return (app.get_cohort_index.__wrapped__(df, 'k', 'PreScore', 'PostScore', ('Course', 'Section')),
+            app.search_text(df['Feedback']).reset_index(drop=True),
+            columns[0].str.cat(columns[1:], sep='\x1f'))
+
+
+def assert_same_indexes(actual, expected):
+    cohort, search, row_search = actual
+    pd.testing.assert_frame_equal(cohort['parts'], expected[0]['parts'])
+    pd.testing.assert_series_equal(cohort['totals'], expected[0]['totals'])
+    for col, group in expected[0]['groups'].items():
+        pd.testing.assert_frame_equal(cohort['groups'][col]['stats'], group['stats'])
+        assert group['positions'].keys() == cohort['groups'][col]['positions'].keys()
+    pd.testing.assert_series_equal(search, expected[1])
+    pd.testing.assert_series_equal(row_search, expected[2])
+
+
+def test_patched_indexes_match_a_full_rebuild(store, monkeypatch):
+    indexes(store)
+    parts_sizes = []
+    cohort_parts = app.cohort_parts
+    monkeypatch.setattr(app, 'cohort_parts', lambda df, *args: parts_sizes.append(len(df)) or cohort_parts(df, *args))
+
+    def edit(df):
+        df.loc[[3, 50, 399], 'PostScore'] = [np.nan, 100.0, 0.0]
+        df.loc[7, 'PreScore'] = 55.5
+        df.loc[[3, 8], 'Feedback'] = ['GREAT', None]
+
+    edit_and_publish(store, store['data'], edit)
+    assert store['delta']['rows'].tolist() == [3, 7, 8, 50, 399]
+    patched = indexes(store)
+    assert parts_sizes == [5]
+    assert_same_indexes(patched, rebuilt(store))
+
+
+def test_editing_a_group_column_rebuilds_the_cohort_index(store, monkeypatch):
+    indexes(store)
+    parts_sizes = []
+    cohort_parts = app.cohort_parts
+    monkeypatch.setattr(app, 'cohort_parts', lambda df, *args: parts_sizes.append(len(df)) or cohort_parts(df, *args))
+
+    def edit(df):
+        df.loc[[1, 2], 'Course'] = ['EE', None]
+        df.loc[2, 'PostScore'] = 1.0
+
+    edit_and_publish(store, store['data'], edit)
+    cohort = indexes(store)
+    assert parts_sizes == [400]
+    assert_same_indexes(cohort, rebuilt(store))
+    assert 'EE' in cohort[0]['groups']['Course']['positions']